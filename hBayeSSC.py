@@ -1,25 +1,27 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
-from itertools import izip, chain
+from itertools import chain, islice
 import sys
 import os
 import copy
 import random
 import time
-import string
-from math import sqrt
-try:
-    from math import isnan
-except:
-    def isnan(val):
-        return not (float('-inf') <= val <= float('inf'))
-try:
-    from math import isinf
-except:
-    def isinf(val):
-        return val == float('-inf') or val == float('inf')
-
-from optparse import OptionParser, OptionGroup
+import struct
+import shutil
+import tempfile
+import json
+import io
+import socket
+import socketserver
+import threading
+import subprocess
+import multiprocessing
+from array import array
+from collections import deque, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from math import sqrt, isnan, isinf, exp, log, floor
+
+from optparse import OptionParser, OptionGroup, Values
 
 
 """
@@ -30,11 +32,12 @@ Author: David Schanzenbach
 Original script by: Yvonne Chan
 
 Original Version: 20131224
-- Should work with python 2.4 and any newer python 2.x release
+- Requires python 3.  Output files are written exactly as the python 2 releases wrote them.
 
 Assumptions: 
 - Assume the population count is always 1
-- Assume only 1 iteration in BayeSSC per run
+- The initial mode runs a single BayeSSC iteration per run; the posterior mode, whose par file of a species
+  is the same for every trial, runs the --repeat iterations of a species in one BayeSSC run
 """
 
 # https://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
@@ -42,31 +45,64 @@ def chunks(l, n):
     """ 
     Yield successive n-sized chunks from l.
     """
-    for i in xrange(0, len(l), n):
-	yield l[i:i+n]
+    for i in range(0, len(l), n):
+        yield l[i:i+n]
+
+def formatValue(value):
+    """
+    str() of a value, the way python 2 wrote it.  Floats are written with 12 significant digits
+    (and a trailing .0 when they look like an integer), so the output files match the python 2 releases.
+    """
+    if not isinstance(value, float):
+        return str(value)
+    s = "%.12g"%(value)
+    if s.lstrip("-").isdigit():
+        if len(s.lstrip("-")) < 12:
+            return s + ".0"
+        # python 2 switched to the exponent notation when the .0 would not fit in 12 digits
+        mantissa, exponent = ("%.11e"%(value)).split("e")
+        s = mantissa.rstrip("0").rstrip(".") + "e" + exponent
+    return s
 
 def skipNanInf(value):
     """
     The default filtering action used by RunningStat when using Push()
     """
     try:
-	value = float(value)
-	return isnan(value) or isinf(value)
+        value = float(value)
+        return isnan(value) or isinf(value)
     except ValueError:
-	return True
+        return True
 
 
 class BadBayesOutput(Exception):
     """
-    custom exception class to signify we had a problem with the BayeSSC output/execution
+    custom exception class to signify we had a problem with the BayeSSC output/execution.
+    'kind' classifies a failed BayeSSC run (one of KINDS) and 'stderr' holds what BayeSSC wrote to it.
     """
-    def __init__(self, val):
-	self.val = val
+    HEADER = "missing_header"
+    DATA = "missing_data"
+    PARTIAL = "partial_row"
+    EXIT = "nonzero_exit"
+    TIMEOUT = "timeout"
+    ALIGNMENT = "bad_alignment"
+    KINDS = [HEADER, DATA, PARTIAL, EXIT, TIMEOUT, ALIGNMENT]
+
+    def __init__(self, val, kind = None, stderr = ""):
+        self.val = val
+        self.kind = kind
+        self.stderr = stderr
     def __str__(self):
-	return repr(self.val)
+        return repr(self.val)
+
+
+class TooManyFailures(Exception):
+    """ raised by FailurePolicy when BayeSSC fails too often for a species to go on with the run """
 
 
 class CommonData(object):
+    # one instance per species of every trial, __slots__ keeps them small
+    __slots__ = ('label', 'nsam', 'nsites', 'haps', 'seg', 'pair', 'hapdiv', 'nucdiv', 'tajd', 'fusf')
  
     def __init__(self):
         self.label = ""
@@ -80,47 +116,48 @@ class CommonData(object):
         self.tajd = 0.0
         self.fusf = 0.0
 
-	
+        
     def fill(self, label, nsam, nsites, data, nucdiv):
-	self.label = label
-	self.nsam = nsam
-	self.nsites = nsites
-	self.haps = data.get('haptypes', float("NaN") )
-	self.seg = data.get('segsites', float("NaN") )
-	self.pair = data.get('pairdiffs', float("NaN") )
-	self.nucdiv = nucdiv #data.get('nucdiv', data.get('nucltddiv',float("NaN")) )
-	self.hapdiv = data.get('hapdiver', float("NaN") )
-	self.tajd = data.get('tajimasd', float("NaN") )
-	self.fusf = data.get('f*', float("NaN") )
+        self.label = label
+        self.nsam = nsam
+        self.nsites = nsites
+        self.haps = data.get('haptypes', float("NaN") )
+        self.seg = data.get('segsites', float("NaN") )
+        self.pair = data.get('pairdiffs', float("NaN") )
+        self.nucdiv = nucdiv #data.get('nucdiv', data.get('nucltddiv',float("NaN")) )
+        self.hapdiv = data.get('hapdiver', float("NaN") )
+        self.tajd = data.get('tajimasd', float("NaN") )
+        self.fusf = data.get('f*', float("NaN") )
     
     def getlabel(self):
-	return self.label
+        return self.label
 
     def addStats(self, statsdict):
-	statsdict['haps'].Push(self.haps)
-	statsdict['hapdiv'].Push(self.hapdiv)
-	statsdict['nucdiv'].Push(self.nucdiv)
-	statsdict['pair'].Push(self.pair)
-	statsdict['tajd'].Push(self.tajd)
-	statsdict['fusf'].Push(self.fusf)
-	statsdict['segsites'].Push(self.seg)
-	return statsdict
+        statsdict['haps'].Push(self.haps)
+        statsdict['hapdiv'].Push(self.hapdiv)
+        statsdict['nucdiv'].Push(self.nucdiv)
+        statsdict['pair'].Push(self.pair)
+        statsdict['tajd'].Push(self.tajd)
+        statsdict['fusf'].Push(self.fusf)
+        statsdict['segsites'].Push(self.seg)
+        return statsdict
 
  
 class ObservationData(CommonData):
     """ Represents a row in the Observeration file """
     # default column order
     columns = ['species','nsam','nsites','tstv','gamma','gen','locuslow','locushigh','nelow','nehigh','segsites','nucdiv','haptypes','hapdiver','pairdiffs','tajimasd','f*','exphet']
+    __slots__ = ('gamma', 'gen', 'locuslow', 'locushigh', 'neLow', 'neHigh', 'exphet', 'tstv')
     def __init__(self, data = None):
-	super(ObservationData, self).__init__()
-	self.gamma = 0.0
-	self.gen = 0.0
-	self.locuslow = 0.0
-	self.locushigh = 0.0
-	self.neLow = 0.0
-	self.neHigh = 0.0
-	self.exphet = 0.0
-	self.tstv = 0.0
+        super(ObservationData, self).__init__()
+        self.gamma = 0.0
+        self.gen = 0.0
+        self.locuslow = 0.0
+        self.locushigh = 0.0
+        self.neLow = 0.0
+        self.neHigh = 0.0
+        self.exphet = 0.0
+        self.tstv = 0.0
         if data != None:
             self.fill(data)
 
@@ -129,29 +166,30 @@ class ObservationData(CommonData):
         - obsData is a single line in the Observation file
         - statsdata is the data generated in the *_stat.csv from BayeSSC
         - time is a random int, between 2 user defined values.
+        The values that end up in the par file are converted here, once per species
         """
-	super(ObservationData, self).fill(data['species'], data['nsam'], data['nsites'], data, data.get('nucdiv', float("NaN") )) 	           
-        self.tstv = data['tstv']
-        self.gamma = data['gamma']
-        self.gen = data['gen']
-        self.locuslow = data['locuslow']
-        self.locushigh = data['locushigh']
-        self.neLow = data['nelow']
-        self.neHigh = data['nehigh']
+        super(ObservationData, self).fill(data['species'], int(float(data['nsam'])), int(float(data['nsites'])), data, data.get('nucdiv', float("NaN") ))                  
+        self.tstv = float(data['tstv'])
+        self.gamma = float(data['gamma'])
+        self.gen = float(data['gen'])
+        self.locuslow = float(data['locuslow'])
+        self.locushigh = float(data['locushigh'])
+        self.neLow = int(float(data['nelow']))
+        self.neHigh = int(float(data['nehigh']))
         self.exphet = data.get('exphet', float("NaN") )
 
 
     def addStats(self, statsdict):
-	return super(ObservationData, self).addStats(statsdict)
+        return super(ObservationData, self).addStats(statsdict)
 
     def getPopRange(self):
-        return (int(self.neLow), int(self.neHigh))
+        return (self.neLow, self.neHigh)
         
     def getMutationRange(self):
-        return (float(self.locuslow), float(self.locushigh))
+        return (self.locuslow, self.locushigh)
 
     def __str__(self):
-        return "\t".join(map(str, [self.label, self.nsam, self.nsites,
+        return "\t".join(map(formatValue, [self.label, self.nsam, self.nsites,
                                   self.tstv, self.gamma, self.gen, self.locushigh, 
                                   self.locuslow, self.neLow, self.neHigh, self.seg,
                                   self.nucdiv, self.haps, self.hapdiv, self.pair, 
@@ -160,83 +198,99 @@ class ObservationData(CommonData):
 class PostObservationData(ObservationData):
     """ Represents a row in the Observeration file """
     # default column order
+    __slots__ = ('pop', 'expan', 'mutate', 'time')
     def __init__(self, data = None):
-	super(PostObservationData,self).__init__(data)
-	self.pop =0
-	self.expan = 0
-	self.mutate = 0
-	self.time = 0
+        super(PostObservationData,self).__init__(data)
+        self.pop =0
+        self.expan = 0
+        self.mutate = 0
+        self.time = 0
 
     def setPop(self, pop):
-	self.pop = int(pop)
+        self.pop = int(pop)
     def setMutationRate(self, mutate):
-	self.mutate = float(mutate)
+        self.mutate = float(mutate)
     def setExpan(self, expan):
-	self.expan = float(expan)
+        self.expan = float(expan)
     def setTime(self, tm):
-	self.time = int(tm)
+        self.time = int(tm)
 
     def getTime(self):
-	return self.time
+        return self.time
     def getPop(self):
-	return self.pop
+        return self.pop
     def getMutationRate(self):
-	return self.mutate
+        return self.mutate
     def getExpan(self):
-	return self.expan
+        return self.expan
     
 class BayeSSCData(CommonData):
     HEADERS = ['species', 'nsam','nsites', 'haptype', 'segsites', 'pairdiffs', 'hapdiv', 'nucdiv', 'tajimasd', 'fusf','ne', 'expan', 'mu', 'time']
-    """Represents a row in the BayeSSC stats file """
+    """
+    Represents a row in the BayeSSC stats file.
+    The statistics are converted to float once, when the row is parsed.  'tokens' keeps the text BayeSSC wrote
+    for them (haptype to mu, in HEADERS order), so the run data is written exactly as it was read.
+    """
+    __slots__ = ('ne', 'expan', 'mu', 'time', 'alignment', 'tokens')
+    STATS = [('haps', 'haptypes'), ('seg', 'segsites'), ('pair', 'pairdiffs'), ('hapdiv', 'hapdiver'), ('nucdiv', 'nucltddiv'),
+             ('tajd', 'tajimasd'), ('fusf', 'f*'), ('ne', 'deme size'), ('expan', 'event size'), ('mu', 'mutation rate')]
+
     def __init__(self, obs = None, time = None, data = None):
-	super(BayeSSCData, self).__init__()
-	self.ne = 0.0
-	self.expan = 0.0
-	self.mu = 0.0
-	self.time = 0.0
+        super(BayeSSCData, self).__init__()
+        self.ne = 0.0
+        self.expan = 0.0
+        self.mu = 0.0
+        self.time = 0.0
+        self.tokens = ()
+        # simulated sequences, only filled in when the alignments are kept
+        self.alignment = None
         if obs != None and time != None and data != None:
-	    self.fill(obs, time, data)
-	
+            self.fill(obs, time, data)
+        
     def fill(self, obsData, time, statsData):
         """
         - obsData is a single line in the Observation file
         - statsdata is the data generated in the *_stat.csv from BayeSSC
         - time is a random int, between 2 user defined values.
         """
-	super(BayeSSCData, self).fill(obsData.label, obsData.nsam, obsData.nsites, statsData, statsData.get('nucltddiv', float("NaN") ))
-	self.ne = statsData.get('deme size', float("NaN"))
-	self.expan = statsData.get('event size', float("NaN"))
-	self.mu = statsData.get('mutation rate', float("NaN"))
-	self.time = time
-    
+        self.label = obsData.label
+        self.nsam = obsData.nsam
+        self.nsites = obsData.nsites
+        tokens = []
+        for attr, column in BayeSSCData.STATS:
+            token = statsData.get(column, "nan")
+            setattr(self, attr, float(token))
+            tokens.append(token)
+        self.tokens = tuple(tokens)
+        self.time = time
+
+    def __setToken(self, attr, value):
+        """ replace a statistic, and the text written for it """
+        pos = [a for a, c in BayeSSCData.STATS].index(attr)
+        setattr(self, attr, float(value))
+        self.tokens = self.tokens[:pos] + (formatValue(value),) + self.tokens[pos + 1:]
+
     def setNE(self, ne):
-	self.ne = ne
+        self.__setToken('ne', ne)
     def setExpan(self, expan):
-	self.expan = expan
+        self.__setToken('expan', expan)
     def setMU(self, mu):
-	self.mu = mu
+        self.__setToken('mu', mu)
 
     def addStats(self, statsdict):
-	statsdict = super(BayeSSCData, self).addStats(statsdict)
+        statsdict = super(BayeSSCData, self).addStats(statsdict)
 
-	statsdict['mu'].Push(self.mu)
-	statsdict['ne'].Push(self.ne)
-	statsdict['expan'].Push(self.expan)
+        statsdict['mu'].Push(self.mu)
+        statsdict['ne'].Push(self.ne)
+        statsdict['expan'].Push(self.expan)
         #print self.ne
-	return statsdict
+        return statsdict
     
     def header(self):
-	return BayeSSCData.HEADERS
+        return BayeSSCData.HEADERS
 
     def __str__(self):
-        return "\t".join(map(str, [self.label,
-                         self.nsam,    self.nsites, 
-                         self.haps,    self.seg, 
-                         self.pair,    self.hapdiv, 
-                         self.nucdiv,  self.tajd, 
-                         self.fusf,    self.ne, 
-                         self.expan,   self.mu, 
-                         self.time]))
+        return "\t".join([self.label, formatValue(self.nsam), formatValue(self.nsites)] + list(self.tokens) + [formatValue(self.time)])
             
 
 class RunningStat(object):
@@ -244,6 +298,8 @@ class RunningStat(object):
     # original class was written in c++.  This is a conversion to python
     # follows the online_kurtosis function describe at wikipedia:
     # https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Higher-order_statistics
+    __slots__ = ('n', 'M1', 'M2', 'M3', 'M4')
+
     def __init__(self):
         self.Clear()
 
@@ -300,8 +356,8 @@ class RunningStat(object):
             return float('Nan')
         
     def collectMeanAndVariance(self, values = [float('NaN'), float('NaN')] ):
-	if self.n == 0:
-	    return values
+        if self.n == 0:
+            return values
         try:
             values[0] = "%.15f"%(self.Mean())
         except ZeroDivisionError:
@@ -316,9 +372,9 @@ class RunningStat(object):
         # division by zero can occur when dealing with times (model 0 and model 1)
         # force the division by zero to result in all stats being NaN. for our sanity!
         values = [float('NaN'), float('NaN'), float('NaN'), float('NaN')]
-	if self.NumDataValues() == 0:
-	    return values	
-	values = self.collectMeanAndVariance(values)
+        if self.NumDataValues() == 0:
+            return values       
+        values = self.collectMeanAndVariance(values)
         try:
             values[2] = "%.15f"%(self.Skewness())
         except ZeroDivisionError:
@@ -339,51 +395,51 @@ class ParFile(object):
     This results in a messy parser, but it should work.
     """
     def __init__(self, inName):
-	infile = open(inName, "rU")
-	values = []
-	line = 0
-	for l in infile:
-	    l = l.strip()
-	    if (not l) or l.startswith("//"):
-		continue   
-	    if line == 0:
-		self.popcnt = l
-		self.popsize = []
-		if int(self.popcnt.split()[0]) == 0 :
-		    line += 1
-	    elif line == 1:
-		c = int(self.popcnt.split()[0])
-		self.popsize = [l] + [ infile.next().strip() for x in xrange(int(c)-1)]
-	    elif line == 2:
-		self.sSize = l
-	    elif line == 3:
-		self.growth = l
-	    elif line == 4:
-		self.mCnt = l
-		self.migrations = []
-		if int(self.mCnt) == 0:
-		    line += 1
-	    elif line == 5:
-		self.migrations = [l] + [infile.next().strip() for x in xrange(int(l) - 1)]
-	    elif line == 6: 
-		self.eCnt = l
-		self.events = []
-		if int(l.split()[0]) == 0:
-		    line += 1
-	    elif line == 7:
-		c = int(self.eCnt.split()[0])
-		self.events = [self.splitPrior(l)] + [ self.splitPrior(infile.next().strip()) for x in xrange(int(c) - 1)]
-	    elif line == 8:
-		self.rate = l
-	    elif line == 9:
-		self.loci = l
-	    elif line == 10:
-		self.type = l
-	    elif line == 11:
-		self.gamma = l
-	    line += 1
-	infile.close()
-	self.error =  line != 12
+        infile = open(inName, "r")
+        values = []
+        line = 0
+        for l in infile:
+            l = l.strip()
+            if (not l) or l.startswith("//"):
+                continue   
+            if line == 0:
+                self.popcnt = l
+                self.popsize = []
+                if int(self.popcnt.split()[0]) == 0 :
+                    line += 1
+            elif line == 1:
+                c = int(self.popcnt.split()[0])
+                self.popsize = [l] + [ next(infile).strip() for x in range(int(c)-1)]
+            elif line == 2:
+                self.sSize = l
+            elif line == 3:
+                self.growth = l
+            elif line == 4:
+                self.mCnt = l
+                self.migrations = []
+                if int(self.mCnt) == 0:
+                    line += 1
+            elif line == 5:
+                self.migrations = [l] + [next(infile).strip() for x in range(int(l) - 1)]
+            elif line == 6: 
+                self.eCnt = l
+                self.events = []
+                if int(l.split()[0]) == 0:
+                    line += 1
+            elif line == 7:
+                c = int(self.eCnt.split()[0])
+                self.events = [self.splitPrior(l)] + [ self.splitPrior(next(infile).strip()) for x in range(int(c) - 1)]
+            elif line == 8:
+                self.rate = l
+            elif line == 9:
+                self.loci = l
+            elif line == 10:
+                self.type = l
+            elif line == 11:
+                self.gamma = l
+            line += 1
+        infile.close()
+        self.error =  line != 12
 
     def splitPrior(self, line):
         """
@@ -391,90 +447,90 @@ class ParFile(object):
         We utilize a similar idea found in the BayeSSC code that only looks
         for paired {} and considers whatever that range is, to be a single value
         """
-	ele = []
-	i = 0
-	buf = ""
-
-	while i < len(line):
-	    c = line[i]
-	    if c.isspace():
-		if buf:
-		    ele.append(buf)
-		    buf = ""
-		i += 1
-		continue
-	    if c == '{':
-		pos = line[i:].find('}')
+        ele = []
+        i = 0
+        buf = ""
+
+        while i < len(line):
+            c = line[i]
+            if c.isspace():
+                if buf:
+                    ele.append(buf)
+                    buf = ""
+                i += 1
+                continue
+            if c == '{':
+                pos = line[i:].find('}')
                 if(pos == 1):
                     raise RuntimeError("Unbalanced { } in the par file")
-		line = line[i:]
-		ele.append( "".join( line[:pos+1].split() ) )
-		line = line[pos+1:]
-		i = 0
-	    else:
-		buf += c
-		i += 1
-	if(buf):
-	    ele.append(buf)
-	return " ".join([e.replace(" ", "") for e in ele])
+                line = line[i:]
+                ele.append( "".join( line[:pos+1].split() ) )
+                line = line[pos+1:]
+                i = 0
+            else:
+                buf += c
+                i += 1
+        if(buf):
+            ele.append(buf)
+        return " ".join([e.replace(" ", "") for e in ele])
 
     def setStaticPop(self, pop):
-	 self.popsize = ["%s"%(pop) for r in self.popsize]
+         self.popsize = ["%s"%(pop) for r in self.popsize]
 
     def setExpan(self, expan):
-	npop = []
-	for r in self.events:
-	    ele = r.split()
-	    ele[4] = "%.15f"%(expan)
-	    npop.append(" ".join(ele))
-	self.events = npop   
+        npop = []
+        for r in self.events:
+            ele = r.split()
+            ele[4] = "%.15f"%(expan)
+            npop.append(" ".join(ele))
+        self.events = npop   
     
     def setStaticLociRate(self, locirate):
-	self.rate = "%.15f"%(locirate)
-	
+        self.rate = "%.15f"%(locirate)
+        
     def setPopulation(self, distro, poprng):
-	self.popsize = ["{%s:%s,%s}"%(distro, poprng[0], poprng[1]) for r in self.popsize]
+        self.popsize = ["{%s:%s,%s}"%(distro, poprng[0], poprng[1]) for r in self.popsize]
     
     def setTime(self, time):
-	npop = []
-	for r in self.events:
-	    ele = r.split()
-	    ele[0] = str(time)
-	    npop.append(" ".join(ele))
-	self.events = npop        
+        npop = []
+        for r in self.events:
+            ele = r.split()
+            ele[0] = str(time)
+            npop.append(" ".join(ele))
+        self.events = npop        
 
     def setLociRate(self, distro, locrng):
-	self.rate = "{%s:%.15f,%.15f}"%(distro, locrng[0], locrng[1])
+        self.rate = "{%s:%.15f,%.15f}"%(distro, locrng[0], locrng[1])
 
     def setLoci(self, lociCnt):
-	self.loci = lociCnt
+        self.loci = lociCnt
 
     def setSampleSize(self, size):
-	self.sSize = size
+        self.sSize = size
 
     def setTSTV(self, tstv):
-	v = self.type.split()
-	v[1] = "%.15f"%(float(tstv))
-	self.type = " ".join(v)
+        v = self.type.split()
+        v[1] = "%.15f"%(tstv)
+        self.type = " ".join(v)
     
     def setgamma(self, gamma):
-	v = self.gamma.split()
-	v[0] = "%.15f"%(float(gamma))
-	self.gamma = " ".join(v)
+        v = self.gamma.split()
+        v[0] = "%.15f"%(gamma)
+        self.gamma = " ".join(v)
     
     def matrixStr(self):
-	if(self.migrations):
-	    return "%s\n%s"%(self.mCnt, "\n".join(self.migrations))
-	else:
-	    return self.mCnt
+        if(self.migrations):
+            return "%s\n%s"%(self.mCnt, "\n".join(self.migrations))
+        else:
+            return self.mCnt
     
     def eventStr(self):
-	if(not self.events):
-	    return ""
-	return "\n".join(self.events)
+        if(not self.events):
+            return ""
+        return "\n".join(self.events)
 
     def __str__(self):       
-	return """//Number of population samples - tmp\n%s\n//Population sizes\n%s\n//Sample sizes\n%s\n//Growth rates\n%s\n//Number of migration matrices : If 0 : No migration between demes\n%s\n//Historical event format:\n%s\n%s\n//mutation rate\n%s\n//Number of independent loci\n%s\n//Data type, num loci, rec.rate, mut rate, gamma, shape\n%s\n//\n%s\n"""%(
+        return """//Number of population samples - tmp\n%s\n//Population sizes\n%s\n//Sample sizes\n%s\n//Growth rates\n%s\n//Number of migration matrices : If 0 : No migration between demes\n%s\n//Historical event format:\n%s\n%s\n//mutation rate\n%s\n//Number of independent loci\n%s\n//Data type, num loci, rec.rate, mut rate, gamma, shape\n%s\n//\n%s\n"""%(
                 self.popcnt, "\n".join(self.popsize), self.sSize, self.growth, self.matrixStr(), self.eCnt, self.eventStr(), self.rate, self.loci, self.type, self.gamma)
 
 
@@ -492,12 +548,12 @@ class ObservationSplitter(object):
         randSpecs = observations[con_species:]
         return conSpecs, randSpecs #, observations
     
-    def __splitUniform(self, observations, con_species, shuffleAction = random.random):
+    def __splitUniform(self, observations, con_species):
         """
         Take the array of observations, and shuffle them using the random() function in python.
         random should be uniform to start, so as a result, shuffle should be uniform as well.
         """
-        random.shuffle(observations, random = shuffleAction)	
+        random.shuffle(observations)
         return self.__splitIndentity(observations, con_species)
 
 
@@ -513,11 +569,161 @@ class TimeGenerator(object):
         """ generated a time value between the high and low value provided """
         return random.randint(min(timerange), max(timerange))
 
-	   
+
+class SimulationPlan(object):
+    """
+    A pre-generated table of every (model, trial) unit of an initial run.
+
+    The file starts with a single tab delimited text header, followed by one fixed size
+    binary record per unit (model major, trial minor).  Each record holds:
+    - the model number and trial number
+    - the congruent time in years (-1 when the model has no congruent species)
+    - the species permutation (indices into the observation file, congruent species first)
+    - the time in years drawn for each species of the permutation
+    - the time in generations (time / gen) handed to BayeSSC for each species of the permutation
+    Because every record has the same size, any unit can be read without reading the units before it.
+    """
+    MAGIC = "#hBayeSSC-plan"
+    VERSION = "1"
+
+    def __init__(self, inName):
+        self.fname = inName
+        self.planf = open(inName, "rb")
+        hdr = self.planf.readline()
+        fields = hdr.decode().rstrip("\n").split("\t")
+        if len(fields) < 2 or fields[0] != SimulationPlan.MAGIC or fields[1] != SimulationPlan.VERSION:
+            raise ValueError("'%s' is not a version %s simulation plan" %(inName, SimulationPlan.VERSION))
+        meta = dict([f.split("=", 1) for f in fields[2:]])
+        self.species = meta['species'].split(",")
+        self.models = list(map(int, meta['models'].split(",")))
+        self.repeats = int(meta['repeats'])
+        self.trange = list(map(int, meta['trange'].split(":")))
+        self.seed = meta['seed']
+        self.tag = meta['tag']
+        self.offset = len(hdr)
+        self.record = SimulationPlan.recordStruct(len(self.species))
+
+    @staticmethod
+    def recordStruct(obsCnt):
+        return struct.Struct("<HIi%dH%di%di" %(obsCnt, obsCnt, obsCnt))
+
+    def __len__(self):
+        return len(self.models) * self.repeats
+
+    def __decode(self, buf):
+        values = self.record.unpack(buf)
+        cnt = len(self.species)
+        model, trial, contime = values[:3]
+        perm = values[3:3 + cnt]
+        times = values[3 + cnt:3 + 2 * cnt]
+        gentimes = values[3 + 2 * cnt:]
+        return model, trial, contime, perm, times, gentimes
+
+    def unit(self, unitNumber):
+        """ random access to a single unit of the plan """
+        if unitNumber < 0 or unitNumber >= len(self):
+            raise IndexError("Plan unit %s out of range (0 to %s)" %(unitNumber, len(self) - 1))
+        self.planf.seek(self.offset + unitNumber * self.record.size)
+        return self.__decode(self.planf.read(self.record.size))
+
+    def units(self, start = 0, end = None):
+        """ generator that sequentially reads the units [start, end) of the plan """
+        if end == None or end > len(self):
+            end = len(self)
+        self.planf.seek(self.offset + start * self.record.size)
+        for x in range(start, end):
+            yield self.__decode(self.planf.read(self.record.size))
+
+    def checkObservations(self, observations):
+        """ make sure the plan was generated for the same observation file """
+        labels = [o.getlabel() for o in observations]
+        if labels != self.species:
+            raise ValueError("Plan '%s' was generated for a different observation file" %(self.fname))
+
+    def close(self):
+        self.planf.close()
+
+
+def writeSimulationPlan(outName, observations, models, repeats, trange, seed = None):
+    """
+    Draw the parameters of every (model, trial) unit up front and store them as a SimulationPlan.
+    All draws come from a single random.Random seeded with 'seed', so a plan can be regenerated exactly.
+    """
+    if seed == None:
+        seed = random.randint(0, sys.maxsize)
+    rng = random.Random(seed)
+    obsCnt = len(observations)
+    record = SimulationPlan.recordStruct(obsCnt)
+    tag = "_".join([formatValue(rng.random()), formatValue(time.time())]).replace(".","_")
+    lo, hi = min(trange), max(trange)
+    gens = [o.gen for o in observations]
+    planf = open(outName, "wb")
+    planf.write("\t".join([SimulationPlan.MAGIC, SimulationPlan.VERSION,
+                           "species=%s" %(",".join([o.getlabel() for o in observations])),
+                           "models=%s" %(",".join(map(str, models))),
+                           "repeats=%s" %(repeats),
+                           "trange=%s:%s" %(lo, hi),
+                           "seed=%s" %(seed),
+                           "tag=%s" %(tag)]).encode() + b"\n")
+    for model in models:
+        for trial in range(repeats):
+            perm = list(range(obsCnt))
+            rng.shuffle(perm)
+            contime = -1
+            times = []
+            if model > 0:
+                contime = rng.randint(lo, hi)
+                times = [contime] * model
+            times.extend([rng.randint(lo, hi) for x in range(obsCnt - model)])
+            gentimes = [int(t / gens[p]) for t, p in zip(times, perm)]
+            planf.write(record.pack(model, trial, contime, *(perm + times + gentimes)))
+    planf.close()
+    return seed
+
+
+class ReservoirSample(object):
+    """
+    A uniform random sample of fixed size drawn from a stream of unknown length, in a single pass.
+    Uses Li's "Algorithm L": once the reservoir is full, the number of items to skip before the next
+    replacement is drawn directly, so the random generator is only called for the items that are kept.
+    """
+    def __init__(self, size, rng = random):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self.w = 1.0
+        self.next = size - 1
+
+    def __skip(self):
+        self.w *= exp(log(self.rng.random()) / self.size)
+        self.next += int(floor(log(self.rng.random()) / log(1.0 - self.w))) + 1
+
+    def Push(self, item):
+        if self.seen < self.size:
+            self.items.append(item)
+            if len(self.items) == self.size:
+                self.__skip()
+        elif self.seen == self.next:
+            self.items[self.rng.randrange(self.size)] = item
+            self.__skip()
+        self.seen += 1
+
+
+def indexModel(indx):
+    """
+    The model (congruent group size) of a hyperstats/run data index.
+    Counted from the end of the index, since the user provided UID may contain '_' itself.
+    """
+    return int(indx.split("_")[-6])
+
+
 def mergeRunningStats(a, b):
     """ Takes 2 RunningStat objects and combines their stored values into a 3rd RunningStat. """
     combined = RunningStat()
     combined.n += a.n + b.n
+    if combined.n == 0:
+        return combined
     delta = b.M1 - a.M1
     delta2 = delta * delta
     delta3 = delta * delta2
@@ -543,10 +749,291 @@ def statsHeader():
      'hapdiv_Mean', 'hapdiv_Variance', 'hapdiv_Skewness', 'hapdiv_Kurtosis',
      'nucdiv_Mean', 'nucdiv_Variance', 'nucdiv_Skewness', 'nucdiv_Kurtosis',
      'tajimasd_Mean', 'tajimasd_Variance', 'tajimasd_Skewness', 'tajimasd_Kurtosis',
-     'fusf_Mean', 'fusf_Variance', 'fusf_Skewness', 'fusf_Kurtosis',	
+     'fusf_Mean', 'fusf_Variance', 'fusf_Skewness', 'fusf_Kurtosis',    
      'pairDiffs_Mean', 'pairDiffs_Variance', 'pairDiffs_Skewness', 'pairDiffs_Kurtosis',
      'segsites_Mean', 'segsites_Variance', 'segsites_Skewness', 'segsites_Kurtosis']
 
+def resolveColumns(specs):
+    """
+    Convert hyperstats column names (see statsHeader()) or column numbers into positions in a split hyperstats row.
+    Column numbers are counted the same way as msReject and R count them: the index is column 1.
+    """
+    hdr = statsHeader()
+    positions = []
+    for spec in specs:
+        spec = spec.strip()
+        if spec.isdigit():
+            pos = int(spec) - 1
+            if pos < 1 or pos > len(hdr):
+                raise ValueError("Column number %s is out of range (2 to %s)" %(spec, len(hdr) + 1))
+        elif spec in hdr:
+            pos = hdr.index(spec) + 1
+        else:
+            raise ValueError("Unknown hyperstats column '%s'" %(spec))
+        positions.append(pos)
+    return positions
+
+def columnStatsPath(hyperstatsName):
+    """ the sidecar holding the ColumnStats of a hyperstats file """
+    return hyperstatsName + ".stats.json"
+
+
+class ColumnStats(object):
+    """
+    A RunningStat for every column of a hyperstats file, pushed as the rows are written and saved in a
+    JSON sidecar (see columnStatsPath()), so the scaling of the columns is known without reading the table again.
+    'base' holds the statistics of the rows that were already in the file when the run appended to it,
+    the two are combined with mergeRunningStats() when saved.
+    The sidecar records the size of the hyperstats file it describes; a file that grew (or shrank) since is rescanned.
+    The median absolute deviation needs the values themselves and can not be merged, only the moments are kept.
+    """
+    def __init__(self, columns = None, base = None):
+        self.columns = columns or statsHeader()
+        self.stats = [RunningStat() for c in self.columns]
+        self.rows = 0
+        self.base = base
+
+    def Push(self, values):
+        """ values is a hyperstats row without its index """
+        self.rows += 1
+        for stat, value in zip(self.stats, values):
+            stat.Push(value)
+
+    def merge(self, other):
+        if self.columns != other.columns:
+            raise ValueError("Can not merge the statistics of different hyperstats columns")
+        merged = ColumnStats(self.columns)
+        merged.rows = self.rows + other.rows
+        merged.stats = [mergeRunningStats(a, b) for a, b in zip(self.stats, other.stats)]
+        return merged
+
+    def total(self):
+        """ the statistics of the whole file: the existing rows merged with the rows pushed by this run """
+        if self.base:
+            return self.base.merge(self)
+        return self
+
+    def scaling(self, positions):
+        """ (mean, standard deviation) of the columns at positions of a split hyperstats row (see resolveColumns()) """
+        stats = self.total().stats
+        scales = []
+        for pos in positions:
+            stat = stats[pos - 1]
+            try:
+                scales.append((stat.Mean(), stat.StandardDeviation()))
+            except ZeroDivisionError:
+                scales.append((stat.Mean(), float('NaN')))
+        return scales
+
+    def save(self, hyperstatsName):
+        """ write the sidecar of hyperstatsName, which must be flushed first """
+        total = self.total()
+        data = {'columns': total.columns,
+                'rows': total.rows,
+                'bytes': os.path.getsize(hyperstatsName),
+                'stats': [{'n': s.n, 'M1': s.M1, 'M2': s.M2, 'M3': s.M3, 'M4': s.M4} for s in total.stats]}
+        path = columnStatsPath(hyperstatsName)
+        tmp = "%s.tmp.%s"%(path, os.getpid())
+        sidecar = open(tmp, "w")
+        json.dump(data, sidecar)
+        sidecar.close()
+        os.replace(tmp, path)
+
+    @staticmethod
+    def load(hyperstatsName):
+        """ the ColumnStats of the sidecar of hyperstatsName, None when it is missing or out of date """
+        path = columnStatsPath(hyperstatsName)
+        if not os.path.exists(path):
+            return None
+        data = json.load(open(path, "r"))
+        if data['bytes'] != os.path.getsize(hyperstatsName):
+            return None
+        stats = ColumnStats(data['columns'])
+        stats.rows = data['rows']
+        for stat, values in zip(stats.stats, data['stats']):
+            stat.n = values['n']
+            stat.M1, stat.M2, stat.M3, stat.M4 = values['M1'], values['M2'], values['M3'], values['M4']
+        return stats
+
+    @staticmethod
+    def scan(hyperstatsName, workers = 1):
+        """ compute the statistics of an existing hyperstats file (see mapRanges()) and save its sidecar """
+        stats = ColumnStats()
+        for part in mapRanges(rangeColumnStats, hyperstatsName, workers = workers):
+            stats = stats.merge(part)
+        stats.save(hyperstatsName)
+        return stats
+
+    @staticmethod
+    def forTable(hyperstatsName, workers = 1):
+        """ the statistics of hyperstatsName, from its sidecar when it is up to date """
+        stats = ColumnStats.load(hyperstatsName)
+        if stats == None:
+            print("Computing the column statistics of '%s'" %(hyperstatsName), file=sys.stderr)
+            stats = ColumnStats.scan(hyperstatsName, workers)
+        return stats
+
+
+def openHyperstats(hyperstatsName, append = False, workers = 1):
+    """
+    open a hyperstats output and the ColumnStats its rows are pushed to.  With append the rows are
+    written after those already in the file, and the statistics of the existing rows become the base.
+    """
+    base = None
+    if append and os.path.exists(hyperstatsName) and os.path.getsize(hyperstatsName) > 0:
+        base = ColumnStats.forTable(hyperstatsName, workers)
+    return open(hyperstatsName, "a" if append else "w"), ColumnStats(base = base)
+
+
+# Parallel reading of the large text tables (hyperstats, run data).  The file is cut into byte ranges
+# that begin and end on line boundaries and every range is parsed on its own, by a pool of processes.
+# The ranges only depend on the size of the file, so the results are the same for any number of workers.
+RANGE_SIZE = 64 * 1024 * 1024
+
+def lineRanges(fname, rangeSize = RANGE_SIZE):
+    """ the byte ranges [start, end) of fname, of about rangeSize bytes each.  Every line begins in exactly one of them. """
+    size = os.path.getsize(fname)
+    count = max(1, -(-size // rangeSize))
+    bounds = [0]
+    fin = open(fname, "rb")
+    for i in range(1, count):
+        # the first line that begins at or after the cut
+        fin.seek(size * i // count - 1)
+        fin.readline()
+        if bounds[-1] < fin.tell() < size:
+            bounds.append(fin.tell())
+    fin.close()
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def rangeLines(fname, start, end):
+    """ generator that returns (byte offset, line) for every line of fname that begins in [start, end) """
+    fin = open(fname, "rb")
+    fin.seek(start)
+    offset = start
+    while offset < end:
+        l = fin.readline()
+        if not l:
+            break
+        yield offset, l.decode()
+        offset += len(l)
+    fin.close()
+
+def mapRanges(function, fname, args = (), workers = 1, rangeSize = RANGE_SIZE):
+    """
+    generator that returns function(fname, start, end, *args) for every lineRanges() of fname, in file order.
+    With more than 1 worker the ranges are parsed by a pool of processes, at most 2 ranges per worker ahead
+    of the caller, so function must be a module level function and its arguments and result picklable.
+    """
+    ranges = lineRanges(fname, rangeSize)
+    if workers <= 1 or len(ranges) == 1:
+        for start, end in ranges:
+            yield function(fname, start, end, *args)
+        return
+    pool = multiprocessing.Pool(min(workers, len(ranges)))
+    try:
+        pending = deque()
+        for start, end in ranges:
+            if len(pending) == 2 * workers:
+                yield pending.popleft().get()
+            pending.append(pool.apply_async(function, (fname, start, end) + tuple(args)))
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def rangeColumns(fname, start, end, positions):
+    """
+    the rows of fname (with an index and at least one value) that begin in [start, end): their byte offsets (array 'q'),
+    their indices and the float values of their fields at positions, row after row (array 'd', for numpy.frombuffer())
+    """
+    offsets = array('q')
+    indices = []
+    values = array('d')
+    for offset, l in rangeLines(fname, start, end):
+        ls = l.rstrip("\n").split("\t")
+        if len(ls) < 2:
+            continue
+        offsets.append(offset)
+        indices.append(ls[0])
+        values.extend([float(ls[p]) for p in positions])
+    return offsets, indices, values
+
+def rangeRows(fname, start, end, indices):
+    """ the lines of fname that begin in [start, end) and whose first field is in indices """
+    return [l for offset, l in rangeLines(fname, start, end) if l.split("\t", 1)[0].strip() in indices]
+
+def rangeColumnStats(fname, start, end):
+    """ the ColumnStats of the hyperstats rows that begin in [start, end) """
+    stats = ColumnStats()
+    for offset, l in rangeLines(fname, start, end):
+        ls = l.rstrip("\n").split("\t")
+        if len(ls) < 2:
+            continue
+        stats.Push(ls[1:])
+    return stats
+
+class OnlineRejection(object):
+    """
+    Rejection step applied while the trials are simulated, instead of on the written reference table.
+    Each trial is scored as it is produced by the scaled euclidean distance of its hyperstats 'positions'
+    to the observed hyperstats, and only the 'accept' closest trials (hyperstats and run data rows)
+    are kept, along with a uniform ReservoirSample of 'priorSample' hyperstats rows.
+
+    The columns are scaled by fixed standard deviations ('scales', for instance from the column statistics of
+    a pilot table) or else by the running standard deviations of every trial so far ('columnStats').  With the
+    running scaling, twice as many trials are kept until the end, when they are scored again with the final scaling.
+    """
+    def __init__(self, observed, positions, accept, priorSample = 0, scales = None, columnStats = None, rng = random):
+        self.observed = observed
+        self.positions = positions
+        self.accept = accept
+        self.scales = scales
+        self.columnStats = columnStats
+        self.capacity = accept
+        if scales == None:
+            self.capacity = 2 * accept
+        self.prior = ReservoirSample(priorSample, rng)
+        self.kept = []
+        self.scored = 0
+
+    def add(self, stats, hyperstatsLine, runDataLine = None):
+        """ stats is the hyperstats row without its index, as returned by computeStats() """
+        if self.prior.size:
+            self.prior.Push(hyperstatsLine)
+        values = [float(stats[p - 1]) for p in self.positions]
+        self.scored += 1
+        if [v for v in values if isnan(v) or isinf(v)]:
+            return
+        self.kept.append((self.scored, values, hyperstatsLine, runDataLine))
+        if len(self.kept) >= 2 * self.capacity:
+            self.__prune(self.capacity)
+
+    def __currentScales(self):
+        scales = self.scales
+        if scales == None:
+            scales = [sd for mean, sd in self.columnStats.scaling(self.positions)]
+        return [s if s > 0 else 1.0 for s in scales]
+
+    def __prune(self, count):
+        scales = self.__currentScales()
+        def distance(kept):
+            return sqrt(sum([((v - o) / s) ** 2 for v, o, s in zip(kept[1], self.observed, scales)]))
+        self.kept = sorted(self.kept, key = distance)[:count]
+
+    def write(self, hyperstatsOut, runDatOut = None, priorOut = None):
+        """ write the accepted trials, in the order they were simulated, and the prior sample """
+        self.__prune(self.accept)
+        for order, values, hyperstatsLine, runDataLine in sorted(self.kept, key = lambda k: k[0]):
+            print(hyperstatsLine, file=hyperstatsOut)
+            if runDatOut and runDataLine != None:
+                print(runDataLine, file=runDatOut)
+        if priorOut:
+            for hyperstatsLine in self.prior.items:
+                print(hyperstatsLine, file=priorOut)
+
+
 def computeStats(congruentCnt, total, conspecData = None, randomData = None, obsData = None):
     """ Using the collect data from multipl repeats, compute some statistics on particular data columns """
     statsdict = dict(expan = RunningStat(), mu = RunningStat(), ne = RunningStat(), contime = RunningStat(), 
@@ -554,17 +1041,17 @@ def computeStats(congruentCnt, total, conspecData = None, randomData = None, obs
                  pair = RunningStat(), segsites = RunningStat(), tajd = RunningStat(), fusf = RunningStat(), overalltime = RunningStat())
     if conspecData or randomData:
         for row in conspecData:
-	    statsdict = row.addStats(statsdict)
+            statsdict = row.addStats(statsdict)
             statsdict['contime'].Push(row.time)
         for row in randomData:
-	    statsdict = row.addStats(statsdict)
+            statsdict = row.addStats(statsdict)
             statsdict['rndtime'].Push(row.time)
         statsdict['overalltime'] = mergeRunningStats( statsdict['rndtime'], statsdict['contime'])
         stats = [congruentCnt, total, "%.15f"%(float(congruentCnt) / float(total)) ]             
     elif obsData:
         # compute the stats for the observation file.  Computer only those that are identical to the hyperstats output
         for row in obsData:
-	    statsdict = row.addStats(statsdict)
+            statsdict = row.addStats(statsdict)
         stats = [float('NaN'), float('NaN'), float('NaN')]
     else:
         raise BadBayesOutput("No observation data, congruent data or random data found to compute stats on")
@@ -577,108 +1064,565 @@ def computeStats(congruentCnt, total, conspecData = None, randomData = None, obs
         tmp.append(v)
     stats.extend(chain( *tmp))
     stats.extend(chain( *[statsdict[k].collectStats() for k in ['haps', 'hapdiv', 'nucdiv', 'tajd', 'fusf', 'pair', 'segsites']] ))
-    return map(str, stats)
+    return list(map(formatValue, stats))
     
 
+class FailurePolicy(object):
+    """
+    What a run does about failing BayeSSC runs, shared by all the BayeSSC objects of the run.
+    - every run is counted per species, and every failure per species and BadBayesOutput kind
+    - the par file and stderr of a failure are copied to the 'quarantine' directory, which keeps the last 'quarantineSize' failures
+    - 'action' is what a failure leads to: 'retry' runs the same par file again right away (BayeSSC draws new values
+      for the priors of the par file every run), 'backoff' waits 1, 2, 4 ... seconds (at most MAX_BACKOFF) before it does, and
+      'redraw' gives the trial up once the retries of a species are used, the model draws another one (see Model.execute())
+    - TooManyFailures is raised as soon as a species fails in 'maxRate' of at least 'minAttempts' runs, or of its runs so far
+      when a par file used all of its retries, so a parameter region BayeSSC can not simulate stops the run instead of
+      using most of its CPU time
+    """
+    ACTIONS = ['retry', 'backoff', 'redraw']
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, action = 'retry', maxRate = 0.5, minAttempts = 20, quarantine = None, quarantineSize = 100, status = None):
+        self.action = action
+        self.maxRate = maxRate
+        self.minAttempts = minAttempts
+        self.quarantine = quarantine
+        self.quarantineSize = quarantineSize
+        self.status = status
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.failures = {}
+        self.kept = deque()
+        self.saved = 0
+
+    def started(self, species):
+        with self.lock:
+            self.attempts[species] = self.attempts.get(species, 0) + 1
+        if self.status:
+            self.status.speciesStarted(species)
+
+    def failed(self, species, error, par, last = False):
+        """
+        record a failure of a run of the par file, raises TooManyFailures when the species fails too often.
+        'last' is set for the failure of the last retry of the par file, the rate is then checked before minAttempts runs.
+        """
+        kind = error.kind or "other"
+        with self.lock:
+            counts = self.failures.setdefault(species, {})
+            counts[kind] = counts.get(kind, 0) + 1
+            failed = sum(counts.values())
+            attempts = self.attempts.get(species, 0)
+            if self.quarantine and self.quarantineSize > 0:
+                self.__keep(species, kind, error, par)
+        if self.status:
+            self.status.speciesFailed(species, kind)
+        if (attempts >= self.minAttempts or last) and failed >= self.maxRate * attempts:
+            raise TooManyFailures("BayeSSC failed in %s of %s runs for species '%s' (%s)%s" %(failed, attempts, species, self.describe(species),
+                                  ", the failing par files are in '%s'" %(self.quarantine) if self.quarantine else ""))
+
+    def __keep(self, species, kind, error, par):
+        """ copy the par file and stderr of a failure to the quarantine, and remove the oldest failure beyond quarantineSize """
+        if not os.path.isdir(self.quarantine):
+            os.makedirs(self.quarantine)
+        self.saved += 1
+        name = os.path.join(self.quarantine, "%s_%s_%06d_%s"%(species.replace(os.sep, "_").replace(" ", "_"), kind, self.saved, os.getpid()))
+        parf = open(name + ".par", "w")
+        parf.write(str(par))
+        parf.close()
+        errf = open(name + ".stderr", "w")
+        print("# %s: %s" %(kind, error.val), file=errf)
+        errf.write(error.stderr)
+        errf.close()
+        self.kept.append(name)
+        while len(self.kept) > self.quarantineSize:
+            old = self.kept.popleft()
+            for ext in (".par", ".stderr"):
+                if os.path.exists(old + ext):
+                    os.remove(old + ext)
+
+    def wait(self, attempt):
+        """ called between the attempts of a par file """
+        if self.action == 'backoff':
+            time.sleep(min(2.0 ** attempt, FailurePolicy.MAX_BACKOFF))
+
+    def describe(self, species):
+        return ", ".join(["%s: %s" %(kind, cnt) for kind, cnt in sorted(self.failures.get(species, {}).items())])
+
+    def report(self, out = sys.stderr):
+        """ print the failure rate of every species with failures """
+        with self.lock:
+            for species in sorted(self.failures):
+                failed = sum(self.failures[species].values())
+                print("BayeSSC failed in %s of %s runs for species '%s' (%s)" %(failed, self.attempts[species], species, self.describe(species)), file=out)
+
+
 class BayeSSC(object):
     """ A class that represents the execution and parsing of the BayeSSC application """
 
-    def __init__(self, execpath, retries = 10):
+    def __init__(self, execpath, retries = 10, keepAlignments = False, status = None, policy = None, timeout = None):
         self.execpath = execpath
         self.retires = retries
+        self.keepAlignments = keepAlignments
+        self.status = status
+        self.policy = policy or FailurePolicy(status = status)
+        # seconds a BayeSSC run may take before it is killed, None waits for it
+        self.timeout = timeout
         
+    def __getAlignmentPath(self, parPath, iteration = 0):
+        """ convert the par file path into the path of the arlequin file BayeSSC generates for an iteration """
+        return os.path.splitext(parPath)[0] + "_%s.arp"%(iteration)
+
     def __getStatsPath(self, parPath):
         """ convert the par file path into the bayessc stats file path. """
         # TODO: DLS - This may break under certain conditions.  need to verify
-	#	parfile = os.path.split(parPath)[-1]
-	#	parfile = os.path.splitext(parfile)[0] + "_stat.csv"
-	#    return os.path.join(workdir, parfile)
+        #       parfile = os.path.split(parPath)[-1]
+        #       parfile = os.path.splitext(parfile)[0] + "_stat.csv"
+        #    return os.path.join(workdir, parfile)
         return os.path.splitext(parPath)[0] + "_stat.csv"
 
-    def __parseBayeSSCOut(self, filePath):
-        """ takes the output from BayeSSC and places it into a dictionary """
+    def __parseBayeSSCOut(self, filePath, iterations = 1):
+        """ takes the output from BayeSSC and places each of the 'iterations' data rows into a dictionary """
         # with our assumption of 1 pop, combined and group 0 will be the same, so filter out the dup and store in a dict with the 0 removed
-        statsf = open(filePath, "rU")
         try:
-            hdr = [ c.replace(" 0", "").strip().lower() for c in statsf.next().strip().split(",")]
-        except:
-            raise  BadBayesOutput("Header Not Found")
-        datadict = {}	
-        d = ""
+            statsf = open(filePath, "r")
+        except IOError:
+            raise BadBayesOutput("Stats File Not Found", BadBayesOutput.HEADER)
         try:
-            d = statsf.next().strip().split(",")
+            hdr = [ c.replace(" 0", "").strip().lower() for c in next(statsf).strip().split(",")]
         except:
-            raise BadBayesOutput("Data Not Found")		
-        if len(d) != len(hdr):
-            raise BadBayesOutput("Data row is only partial")
-        used = {}
-        for h, v in izip(hdr, d):
-            if h not in used and v:
-                datadict[h] = v
-                used[h] = None	
+            raise  BadBayesOutput("Header Not Found", BadBayesOutput.HEADER)
+        rows = []
+        for x in range(iterations):
+            d = ""
+            try:
+                d = next(statsf).strip().split(",")
+            except:
+                raise BadBayesOutput("Data Not Found", BadBayesOutput.DATA)
+            if len(d) != len(hdr):
+                raise BadBayesOutput("Data row is only partial", BadBayesOutput.PARTIAL)
+            datadict = {}   
+            used = {}
+            for h, v in zip(hdr, d):
+                if h not in used and v:
+                    datadict[h] = v
+                    used[h] = None  
+            rows.append(datadict)
         statsf.close()
-        return datadict	
+        return rows 
 
-    def runBayeSSC(self, obs, ctime, par, outdir = ".", parname = "tmp.par"):
-        """ Execute BayeSSC and then parse the data generated by the run. """
+    def runBayeSSC(self, obs, ctime, par, outdir = ".", parname = "tmp.par", iterations = 1):
+        """
+        Execute BayeSSC and then parse the data generated by the run.
+        BayeSSC simulates the par file 'iterations' times, a BayeSSCData is returned for each iteration.
+        """
         fpath = os.path.join(outdir, parname)
         o = open(fpath, "w")
         o.write(par.__str__())
         o.close()
-        os.system("%s -f %s 1 2>/dev/null >/dev/null"%(self.execpath, fpath))
-        data = self.__parseBayeSSCOut(self.__getStatsPath(fpath))
-	
-        return BayeSSCData(obs, ctime, data)
+        if self.keepAlignments:
+            for i in range(iterations):
+                if os.path.exists(self.__getAlignmentPath(fpath, i)):
+                    os.remove(self.__getAlignmentPath(fpath, i))
+        # the output of the previous run must not pass for the output of a run that failed
+        if os.path.exists(self.__getStatsPath(fpath)):
+            os.remove(self.__getStatsPath(fpath))
+        try:
+            proc = subprocess.run([self.execpath, "-f", fpath, str(iterations)], stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, timeout = self.timeout)
+        except subprocess.TimeoutExpired as e:
+            raise BadBayesOutput("BayeSSC did not finish in %s seconds" %(self.timeout), BadBayesOutput.TIMEOUT, (e.stderr or b"").decode(errors = "replace"))
+        stderr = proc.stderr.decode(errors = "replace")
+        if proc.returncode != 0:
+            raise BadBayesOutput("BayeSSC exited with status %s" %(proc.returncode), BadBayesOutput.EXIT, stderr)
+        rows = []
+        try:
+            for i, data in enumerate(self.__parseBayeSSCOut(self.__getStatsPath(fpath), iterations)):
+                row = BayeSSCData(obs, ctime, data)
+                if self.keepAlignments:
+                    row.alignment = parseArlequinSequences(self.__getAlignmentPath(fpath, i))
+                    if len(row.alignment) != obs.nsam:
+                        raise BadBayesOutput("Alignment has %s sequences, expected %s" %(len(row.alignment), obs.nsam), BadBayesOutput.ALIGNMENT)
+                rows.append(row)
+        except BadBayesOutput as e:
+            e.stderr = stderr
+            raise
+        return rows
 
-    def exceuteBateSSCWithRetry(self, obs, chngtime, par, outdir):
-        for x in xrange(self.retires):
+    def exceuteBateSSCWithRetry(self, obs, chngtime, par, outdir, iterations = None):
+        """ run a single simulation of the par file, or, when iterations is given, a list with that many simulations """
+        kind = None
+        for x in range(self.retires):
+            self.policy.started(obs.label)
             try:
-                bayeData = self.runBayeSSC(obs, chngtime, par, outdir)
+                bayeData = self.runBayeSSC(obs, chngtime, par, outdir, iterations = iterations or 1)
+                if self.status:
+                    self.status.simulationDone(len(bayeData))
+                if iterations == None:
+                    return bayeData[0]
                 return bayeData
-            except BadBayesOutput:
-                print >> sys.stderr, "Error running bayeSSC.  Trying again"    
-        raise BadBayesOutput("Attempted to run BayeSSC %s times, each run resulted in an output error." %(self.retires))
+            except BadBayesOutput as e:
+                print("Error running bayeSSC for %s (%s: %s).  Trying again" %(obs.label, e.kind, e.val), file=sys.stderr)
+                if self.status:
+                    self.status.retry()
+                kind = e.kind
+                self.policy.failed(obs.label, e, par, x + 1 == self.retires)
+                if x + 1 < self.retires:
+                    self.policy.wait(x)
+        if self.status:
+            self.status.failure()
+        raise BadBayesOutput("Attempted to run BayeSSC %s times for %s, each run resulted in an output error." %(self.retires, obs.label), kind)
+
+
+def parseArlequinSequences(filePath):
+    """
+    Pull the simulated sequences out of the SampleData block of an arlequin (.arp) file.
+    Each data line is '<id> <frequency> <sequence>', a haplotype with a frequency above 1 is repeated.
+    """
+    seqs = []
+    try:
+        arpf = open(filePath, "r")
+    except IOError:
+        raise BadBayesOutput("Alignment Not Found", BadBayesOutput.ALIGNMENT)
+    inData = False
+    for l in arpf:
+        l = l.strip()
+        if not inData:
+            inData = l.replace(" ", "").lower().startswith("sampledata={")
+            continue
+        if l.startswith("}"):
+            break
+        ele = l.split()
+        if len(ele) < 3:
+            continue
+        seqs.extend([ele[2].upper()] * int(ele[1]))
+    arpf.close()
+    if not seqs:
+        raise BadBayesOutput("Alignment Not Found", BadBayesOutput.ALIGNMENT)
+    return seqs
+
+
+class AlignmentStore(object):
+    """
+    Keeps the simulated sequences of every species in a compact per-species file (<species>.aln).
+    Sequences are bit packed, 2 bits per base (A=0, C=1, G=2, T=3) and 4 bases per byte.
+    After a small text header each alignment is stored as a record:
+    - a struct with the length of the index, the number of sequences and the number of sites
+    - the index (the UID of the trial the alignment belongs to)
+    - the packed bases, sequence after sequence
+    """
+    MAGIC = "#hBayeSSC-alignments"
+    VERSION = "1"
+    HEADER = struct.Struct("<HII")
+    BASES = b"ACGT"
+    CODES = bytes.maketrans(BASES, bytes(range(4)))
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.files = {}
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+    @staticmethod
+    def pack(seqs):
+        """ pack a list of equal length sequences into a byte string """
+        bases = "".join(seqs).encode()
+        if bases.translate(None, AlignmentStore.BASES):
+            raise BadBayesOutput("Alignment contains bases other than %s" %(AlignmentStore.BASES.decode()))
+        codes = bases.translate(AlignmentStore.CODES)
+        codes += bytes(-len(codes) % 4)
+        return bytes([a << 6 | c << 4 | g << 2 | t for a, c, g, t in zip(codes[0::4], codes[1::4], codes[2::4], codes[3::4])])
+
+    @staticmethod
+    def read(filePath):
+        """ generator that returns (index, nsam, nsites, packed bases) for every alignment in a store file """
+        alnf = open(filePath, "rb")
+        hdr = alnf.readline().decode().rstrip("\n").split("\t")
+        if len(hdr) < 2 or hdr[0] != AlignmentStore.MAGIC or hdr[1] != AlignmentStore.VERSION:
+            raise ValueError("'%s' is not a version %s alignment store" %(filePath, AlignmentStore.VERSION))
+        while True:
+            buf = alnf.read(AlignmentStore.HEADER.size)
+            if len(buf) < AlignmentStore.HEADER.size:
+                break
+            indxLen, nsam, nsites = AlignmentStore.HEADER.unpack(buf)
+            indx = alnf.read(indxLen).decode()
+            yield indx, nsam, nsites, alnf.read((nsam * nsites + 3) // 4)
+        alnf.close()
+
+    def add(self, indx, row):
+        """ append the alignment of a single BayeSSCData row to the file of its species """
+        label = row.getlabel()
+        if label not in self.files:
+            fpath = os.path.join(self.outdir, "%s.aln" %(label))
+            exists = os.path.exists(fpath)
+            self.files[label] = open(fpath, "ab")
+            if not exists:
+                self.files[label].write(("\t".join([AlignmentStore.MAGIC, AlignmentStore.VERSION, label]) + "\n").encode())
+        alnf = self.files[label]
+        indx = indx.encode()
+        alnf.write(AlignmentStore.HEADER.pack(len(indx), len(row.alignment), len(row.alignment[0])))
+        alnf.write(indx)
+        alnf.write(AlignmentStore.pack(row.alignment))
+
+    def flush(self):
+        for alnf in self.files.values():
+            alnf.flush()
+
+    def close(self):
+        for alnf in self.files.values():
+            alnf.close()
+        self.files = {}
+
+
+class RunStatus(object):
+    """
+    Machine readable progress of a run.  A JSON status file is rewritten (write then rename, so readers
+    never see a partial file) every 'interval' seconds by a background thread, and once more when the run ends.
+    It holds the completed trials per model, the simulation and trial rates over sliding windows,
+    the retry and failure counts (per species and kind of failure too), an ETA and how many workers are busy.
+    """
+    WINDOWS = (60, 300, 900)
+
+    def __init__(self, path, interval = 5.0, workers = 1):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.state = "starting"
+        self.totals = {}
+        self.done = {}
+        self.simulations = 0
+        self.retries = 0
+        self.failures = 0
+        self.dropped = 0
+        self.species = {}
+        self.workers = dict([(w, None) for w in range(workers)])
+        self.simTimes = deque()
+        self.trialTimes = deque()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def addTotal(self, model, trials):
+        with self.lock:
+            self.totals[model] = self.totals.get(model, 0) + trials
+            self.done.setdefault(model, 0)
+
+    def setWorkers(self, workers):
+        with self.lock:
+            self.workers = dict([(w, None) for w in range(workers)])
+
+    def __trim(self, times, now):
+        while times and times[0] < now - max(RunStatus.WINDOWS):
+            times.popleft()
+
+    def simulationDone(self, count = 1):
+        with self.lock:
+            now = time.time()
+            self.simulations += count
+            self.simTimes.extend([now] * count)
+            self.__trim(self.simTimes, now)
+
+    def trialDone(self, model):
+        with self.lock:
+            now = time.time()
+            self.done[model] = self.done.get(model, 0) + 1
+            self.trialTimes.append(now)
+            self.__trim(self.trialTimes, now)
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def trialDropped(self):
+        with self.lock:
+            self.dropped += 1
+
+    def speciesStarted(self, species):
+        with self.lock:
+            self.species.setdefault(species, {'runs': 0, 'failures': {}})['runs'] += 1
+
+    def speciesFailed(self, species, kind):
+        with self.lock:
+            failures = self.species.setdefault(species, {'runs': 0, 'failures': {}})['failures']
+            failures[kind] = failures.get(kind, 0) + 1
+
+    def workerBusy(self, worker = 0):
+        with self.lock:
+            self.workers[worker] = time.time()
+
+    def workerIdle(self, worker = 0):
+        with self.lock:
+            self.workers[worker] = None
+
+    def __rates(self, times, now):
+        elapsed = max(now - self.started, 1e-9)
+        rates = {}
+        for window in RunStatus.WINDOWS:
+            cnt = len([t for t in times if t >= now - window])
+            rates[str(window)] = cnt / min(float(window), elapsed)
+        return rates
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            done = sum(self.done.values())
+            total = sum(self.totals.values())
+            trialRates = self.__rates(self.trialTimes, now)
+            rate = trialRates[str(RunStatus.WINDOWS[1])]
+            eta = None
+            if rate > 0:
+                eta = max(total - done, 0) / rate
+            busy = [w for w, since in self.workers.items() if since != None]
+            return {'state': self.state,
+                    'host': socket.gethostname(),
+                    'pid': os.getpid(),
+                    'started': self.started,
+                    'updated': now,
+                    'elapsed_seconds': now - self.started,
+                    'trials': {'done': done, 'total': total,
+                               'per_model': dict([(str(m), {'done': self.done.get(m, 0), 'total': t}) for m, t in sorted(self.totals.items())])},
+                    'simulations': self.simulations,
+                    'retries': self.retries,
+                    'failures': self.failures,
+                    'dropped_trials': self.dropped,
+                    'species': dict([(s, {'runs': v['runs'], 'failures': dict(v['failures']),
+                                          'failure_rate': sum(v['failures'].values()) / float(max(v['runs'], 1))}) for s, v in self.species.items()]),
+                    'simulations_per_second': self.__rates(self.simTimes, now),
+                    'trials_per_second': trialRates,
+                    'eta_seconds': eta,
+                    'workers': {'total': len(self.workers), 'busy': len(busy),
+                                'occupancy': len(busy) / float(max(len(self.workers), 1)),
+                                'busy_since': dict([(str(w), self.workers[w]) for w in busy])}}
+
+    def write(self):
+        tmp = "%s.tmp.%s"%(self.path, os.getpid())
+        statusf = open(tmp, "w")
+        json.dump(self.snapshot(), statusf, indent=1, sort_keys=True)
+        statusf.close()
+        os.replace(tmp, self.path)
+
+    def __run(self):
+        while not self.stopEvent.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self.state = "running"
+        self.write()
+        self.thread = threading.Thread(target=self.__run, name="status")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, state = "finished"):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join()
+        self.state = state
+        self.write()
 
 
 class Model(object):
     FIELD_DELIM = "\t"
 
-    def __init__(self, options, par, observations, totalObservations, splitter, timegen, bayessc):
+    def __init__(self, options, par, observations, totalObservations, splitter, timegen, bayessc, alignments = None, columnStats = None, rejection = None):
         self.splitter = splitter
         self.par = par
         self.observations = observations
         self.obsCnt = totalObservations
-        self.options  = options	
+        self.options  = options 
         self.indx =  "%s_%s_%%s_%%%%s_%%s"%(self.options.uid, self.obsCnt)
         self.bayessc = bayessc
         self.timeGenerator = timegen
-		
+        self.alignments = alignments
+        self.columnStats = columnStats
+        self.rejection = rejection
+        self.status = bayessc.status
+                
     def execute(self, modelNumber, hyperstatsOut = None, runDatOut = None):
         """
         a model describes how many observations make up the congruent group.  for instance, model0, means we have no congruent observations.
         This method is meant to contain all actions required to execute this script on a single model.  It will take that model, and
         repeat the experiment multiple times, each time splitting the observations again and again.
         """
-        print >> sys.stderr , ".",
-        indx_raw = self.indx%(modelNumber, "_".join([str(random.random()), str(time.time())]).replace(".","_"))
-        for trial in xrange(int(self.options.repeats)):
-            conSpecs, randSpecs = self.splitter.split(self.observations, modelNumber)
-            outstr = []
-            conspecData= []
-            randomData= []
-            indx = indx_raw%(trial)
-            if conSpecs:
-                rows = self.__generateCONSpecs(self.options.par, self.par, conSpecs, self.options.trange, self.options.outdir, LPType = self.options.LPType)
-                conspecData.extend(rows)
-                outstr.append( Model.FIELD_DELIM.join( map(str, rows) ) )
-            if randSpecs:
-                rows = self.__generateRANDSpecs(self.options.par, self.par, randSpecs, self.options.trange, self.options.outdir, LPType = self.options.LPType)
-                randomData.extend(rows)
-                outstr.append( Model.FIELD_DELIM.join( map(str, rows) ) )
-
-	    print >> hyperstatsOut, Model.FIELD_DELIM.join( [indx] + computeStats(len(conSpecs), self.obsCnt, conspecData, randomData) )
+        print(".", end=" ", file=sys.stderr, flush=True)
+        indx_raw = self.indx%(modelNumber, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+        for trial in range(int(self.options.repeats)):
+            while True:
+                conSpecs, randSpecs = self.splitter.split(self.observations, modelNumber)
+                try:
+                    self._runTrial(indx_raw%(trial), conSpecs, randSpecs, self.options.trange, hyperstatsOut, runDatOut)
+                    break
+                except BadBayesOutput as e:
+                    if not self._giveUpTrial(indx_raw%(trial), e):
+                        raise
+
+    def executePlan(self, plan, start = 0, end = None, hyperstatsOut = None, runDatOut = None):
+        """
+        Execute the units [start, end) of a SimulationPlan.  Nothing is drawn here: the species split and
+        the times all come from the plan, so a unit produces the same parameters no matter which process runs it, or when.
+        """
+        model = None
+        for modelNumber, trial, contime, perm, times, gentimes in plan.units(start, end):
+            if modelNumber != model:
+                print(".", end=" ", file=sys.stderr, flush=True)
+                model = modelNumber
+                indx_raw = self.indx%(modelNumber, plan.tag)
+            conSpecs = [self.observations[i] for i in perm[:modelNumber]]
+            randSpecs = [self.observations[i] for i in perm[modelNumber:]]
+            try:
+                self._runTrial(indx_raw%(trial), conSpecs, randSpecs, plan.trange, hyperstatsOut, runDatOut, contime, times[modelNumber:])
+            except BadBayesOutput as e:
+                # the values of a plan unit are fixed, a unit given up is left out
+                if not self._giveUpTrial(indx_raw%(trial), e):
+                    raise
+
+    def _runTrial(self, indx, conSpecs, randSpecs, trange, hyperstatsOut, runDatOut, contime = None, randtimes = None):
+        """ run BayeSSC for every species of a single trial and write the hyperstats (and run data) rows """
+        if self.status:
+            self.status.workerBusy(self._workerId())
+        conspecData= []
+        randomData= []
+        if conSpecs:
+            conspecData = self.__generateCONSpecs(self.options.par, self.par, conSpecs, trange, self.options.outdir, LPType = self.options.LPType, time = contime)
+        if randSpecs:
+            randomData = self.__generateRANDSpecs(self.options.par, self.par, randSpecs, trange, self.options.outdir, LPType = self.options.LPType, times = randtimes)
+        self._writeTrial(indx, conspecData, randomData, hyperstatsOut, runDatOut)
+        if self.status:
+            self.status.workerIdle(self._workerId())
+            self.status.trialDone(len(conSpecs))
+
+    def _workerId(self):
+        """ the worker reported to the RunStatus, a single process only has worker 0 """
+        return 0
+
+    def _giveUpTrial(self, indx, error):
+        """ True when the trial that failed with error is given up (the 'redraw' failure action), False when the run should stop """
+        if self.bayessc.policy.action != 'redraw':
+            return False
+        print("Gave up trial %s: %s" %(indx, error), file=sys.stderr)
+        if self.status:
+            self.status.workerIdle(self._workerId())
+            self.status.trialDropped()
+        return True
+
+    def _writeTrial(self, indx, conspecData, randomData, hyperstatsOut, runDatOut):
+        outstr = [Model.FIELD_DELIM.join( map(str, rows) ) for rows in (conspecData, randomData) if rows]
+        stats = computeStats(len(conspecData), self.obsCnt, conspecData, randomData)
+        if self.columnStats:
+            self.columnStats.Push(stats)
+        if self.rejection:
+            runDataLine = None
+            if not self.options.onlyHyperstats:
+                runDataLine = Model.FIELD_DELIM.join( [indx] + outstr)
+            self.rejection.add(stats, Model.FIELD_DELIM.join( [indx] + stats ), runDataLine)
+        else:
+            print(Model.FIELD_DELIM.join( [indx] + stats ), file=hyperstatsOut)
             if runDatOut:
-                print >> runDatOut, Model.FIELD_DELIM.join( [indx] + outstr)
+                print(Model.FIELD_DELIM.join( [indx] + outstr), file=runDatOut)
+        if self.alignments:
+            for row in conspecData + randomData:
+                self.alignments.add(indx, row)
 
     def _commonExec(self, obs, parData, time, LPType, PopType, outdir, rows, modifyTime = True):
         chngtime, par = prepareNewParFile(obs, parData, time, LPType, PopType, modifyTime)
@@ -687,90 +1631,308 @@ class Model(object):
             rows.append(row)
         return rows
 
-    def __generateCONSpecs(self, origParName, parData, observations, timerange, outdir, LPType = "U", PopType = "U", timeGenerator =  TimeGenerator("uniform")):
+    def __generateCONSpecs(self, origParName, parData, observations, timerange, outdir, LPType = "U", PopType = "U", timeGenerator =  TimeGenerator("uniform"), time = None):
         """ Iterate all observations in the Congruent group and execute BayeSSC using that particular observation data """
         rows = []
-        time = float(self.timeGenerator.generate(timerange) )   
+        if time == None:
+            time = self.timeGenerator.generate(timerange)
+        time = float(time)
         for obs in observations:
             rows = self._commonExec(obs, parData, time, LPType, PopType, outdir, rows)
         if len(rows) != len(observations):
             raise BadBayesOutput("Did not generate an output for each observation")            
         return rows
 
-    def __generateRANDSpecs(self, origParName, parData, observations, timerange, outdir, LPType = "U", PopType = "U", timeGenerator =  TimeGenerator("uniform")):
+    def __generateRANDSpecs(self, origParName, parData, observations, timerange, outdir, LPType = "U", PopType = "U", timeGenerator =  TimeGenerator("uniform"), times = None):
         """
         Iterate all observations in the Random group and execute BayeSSC using that particular observation data.
-        A new timestamp is generated for each observations. 
+        A new timestamp is generated for each observations, unless the timestamps are provided in 'times'.
         """
         rows = []
-        for obs in observations:
-            time = float(timeGenerator.generate(timerange) )
+        for i, obs in enumerate(observations):
+            if times == None:
+                time = float(timeGenerator.generate(timerange) )
+            else:
+                time = float(times[i])
             rows = self._commonExec(obs, parData, time, LPType, PopType, outdir, rows)
         if len(rows) != len(observations):
             raise BadBayesOutput("Did not generate an output for each observation")
         return rows
 
 
+def observationSignature(obs):
+    """ the observation values that end up in the par file, two species with the same signature are simulated from the same distribution """
+    return "\t".join(map(formatValue, [obs.nsam, obs.nsites, obs.tstv, obs.gamma, obs.gen, obs.locuslow, obs.locushigh, obs.neLow, obs.neHigh]))
+
+
+class SimulationCache(object):
+    """
+    BayeSSC draws shared between the communities (jobs) of a batch.
+    A draw is stored under its rendered par file, so it is only handed out for an identical par file.
+    Each job takes a given draw at most once, so the draws used within one community stay independent,
+    and a draw is dropped once every job that has a species with the same signature took it.
+    The oldest draws are dropped when more than 'capacity' are held.
+    """
+    def __init__(self, sharing, capacity = 10000):
+        self.sharing = sharing
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.held = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def take(self, key, job):
+        with self.lock:
+            for entry in self.entries.get(key, []):
+                row, users, signature = entry
+                if job in users:
+                    continue
+                users.add(job)
+                if users >= self.sharing[signature]:
+                    self.__drop(key, entry)
+                self.hits += 1
+                return row
+            self.misses += 1
+            return None
+
+    def put(self, key, signature, job, row):
+        if len(self.sharing.get(signature, ())) < 2:
+            return
+        with self.lock:
+            self.entries.setdefault(key, []).append((row, set([job]), signature))
+            self.held += 1
+            while self.held > self.capacity:
+                oldest = next(iter(self.entries))
+                self.__drop(oldest, self.entries[oldest][0])
+
+    def __drop(self, key, entry):
+        self.entries[key].remove(entry)
+        if not self.entries[key]:
+            del self.entries[key]
+        self.held -= 1
+
+
+class BatchModel(Model):
+    """
+    A Model for one community (job) of a batch.  Trials of every job run in the worker threads of a
+    single pool, so BatchModel never shuffles the shared observation list and serializes its own output.
+
+    To let the SimulationCache reuse draws between communities, the times of a (model, trial) unit are the
+    same for every job: the congruent time is drawn from a generator seeded by the batch seed, model and trial,
+    and the time of a random species also depends on its signature (and on how many species of the trial
+    share that signature), so the same species gets the same time, and the same par file, in every community.
+    """
+    workers = threading.local()
+    workerCount = 0
+    workerLock = threading.Lock()
+
+    def __init__(self, jobId, options, par, observations, bayessc, cache, seed, workdir, columnStats = None):
+        super(BatchModel, self).__init__(options, par, observations, len(observations), None, None, bayessc, columnStats = columnStats)
+        self.jobId = jobId
+        self.cache = cache
+        self.seed = seed
+        self.workdir = workdir
+        self.lock = threading.Lock()
+        self.tags = {}
+
+    def _workerId(self):
+        if not hasattr(BatchModel.workers, 'id'):
+            with BatchModel.workerLock:
+                BatchModel.workers.id = BatchModel.workerCount
+                BatchModel.workerCount += 1
+        return BatchModel.workers.id
+
+    def executeUnit(self, modelNumber, trial, hyperstatsOut = None, runDatOut = None):
+        """ run a single trial of a model of this job """
+        with self.lock:
+            if modelNumber not in self.tags:
+                self.tags[modelNumber] = self.indx%(modelNumber, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+        rng = random.Random("%s_%s_%s_%s"%(self.seed, self.jobId, modelNumber, trial))
+        order = rng.sample(self.observations, len(self.observations))
+        conSpecs = order[:modelNumber]
+        randSpecs = order[modelNumber:]
+        lo, hi = min(self.options.trange), max(self.options.trange)
+        contime = random.Random("%s_%s_%s"%(self.seed, modelNumber, trial)).randint(lo, hi)
+        randtimes = []
+        seen = {}
+        for obs in randSpecs:
+            signature = observationSignature(obs)
+            seen[signature] = seen.get(signature, 0) + 1
+            randtimes.append(random.Random("%s_%s_%s_%s_%s"%(self.seed, modelNumber, trial, signature, seen[signature])).randint(lo, hi))
+        try:
+            self._runTrial(self.tags[modelNumber]%(trial), conSpecs, randSpecs, self.options.trange, hyperstatsOut, runDatOut, contime, randtimes)
+        except BadBayesOutput as e:
+            # the values of a unit are shared with the other jobs, a unit given up is left out
+            if not self._giveUpTrial(self.tags[modelNumber]%(trial), e):
+                raise
+
+    def _commonExec(self, obs, parData, time, LPType, PopType, outdir, rows, modifyTime = True):
+        chngtime, par = prepareNewParFile(obs, parData, time, LPType, PopType, modifyTime)
+        key = str(par)
+        row = self.cache.take(key, self.jobId)
+        if row == None:
+            workdir = os.path.join(self.workdir, "worker_%s"%(self._workerId()))
+            if not os.path.isdir(workdir):
+                os.makedirs(workdir)
+            row = self.bayessc.exceuteBateSSCWithRetry(obs, chngtime, par, workdir)
+            self.cache.put(key, observationSignature(obs), self.jobId, row)
+        else:
+            row = copy.copy(row)
+            row.label = obs.label
+        rows.append(row)
+        return rows
+
+    def _writeTrial(self, indx, conspecData, randomData, hyperstatsOut, runDatOut):
+        with self.lock:
+            super(BatchModel, self)._writeTrial(indx, conspecData, randomData, hyperstatsOut, runDatOut)
+
+
+SimulatedTrial = namedtuple('SimulatedTrial', ['uid', 'model', 'trial', 'hyperstats', 'records'])
+
+
+class StreamingModel(BatchModel):
+    """ a BatchModel that hands each trial back, hyperstatsOut is a list the SimulatedTrial is appended to """
+    def _writeTrial(self, indx, conspecData, randomData, hyperstatsOut, runDatOut):
+        stats = computeStats(len(conspecData), self.obsCnt, conspecData, randomData)
+        hyperstatsOut.append(SimulatedTrial(indx, indexModel(indx), int(indx.split("_")[-5]), [float(v) for v in stats], conspecData + randomData))
+
+
+class Simulator(object):
+    """
+    In-process access to the initial mode, for pipelines that want the trials as Python objects instead of files.
+
+        sim = Simulator(ParFile("example.par"), parseObs("example_obs"), "./BayeSSC", trange = (1000, 500000), workers = 4)
+        for trial in sim.trials(repeats = 200):
+            # trial.hyperstats follows statsHeader(), trial.records are the BayeSSCData of the species (congruent first)
+            ...
+        sim.close()
+
+    BayeSSC still reads and writes its own files: every worker runs it in a directory under 'workdir'
+    (a temporary directory removed by close() when none is given).  With a seed the species split and the times
+    of a (model, trial) are the same from one run to the next, as in the batch mode.
+    """
+    def __init__(self, par, observations, bayesPath = "BayeSSC", trange = (1000, 20000), uid = "sim", workers = 1, seed = None, LPType = "U", workdir = None, keepAlignments = False):
+        self.observations = observations
+        self.workers = workers
+        self.tmpdir = None
+        if workdir == None:
+            workdir = self.tmpdir = tempfile.mkdtemp(prefix = "hBayeSSC_")
+        if seed == None:
+            seed = random.randint(0, sys.maxsize)
+        options = Values(dict(uid = uid.replace(",","_").replace(" ",""), trange = list(trange), par = None, outdir = workdir,
+                              LPType = LPType, onlyHyperstats = False, repeats = None))
+        bayessc = BayeSSC(bayesPath, keepAlignments = keepAlignments)
+        self.model = StreamingModel(0, options, par, observations, bayessc, SimulationCache({}), seed, workdir)
+        self.pool = ThreadPoolExecutor(workers)
+
+    def observedStats(self):
+        """ the hyperstats vector of the observations (NaN where the observation file has no value) """
+        return [float(v) for v in computeStats(0, len(self.observations), obsData = self.observations)]
+
+    def __run(self, modelNumber, trial):
+        out = []
+        self.model.executeUnit(modelNumber, trial, out)
+        return out[0]
+
+    def trials(self, models = None, repeats = 1, batchSize = 100):
+        """
+        generator of SimulatedTrial (uid, model, trial, hyperstats, records) for 'repeats' trials of each model
+        [default: every model, 0 to the number of observations].  The trials are run by the worker threads
+        'batchSize' at a time and come back in order: model first, then trial.
+        """
+        if models == None:
+            models = range(len(self.observations) + 1)
+        units = ((m, t) for m in models for t in range(repeats))
+        while True:
+            batch = list(islice(units, batchSize))
+            if not batch:
+                break
+            futures = [self.pool.submit(self.__run, m, t) for m, t in batch]
+            for f in futures:
+                yield f.result()
+
+    def close(self):
+        self.pool.shutdown()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class PostModel(Model):    
-    def __init__(self,options, par, conSpecs, randSpecs, bayessc):	
-	super(PostModel, self).__init__(options, par, None, len(conSpecs) + len(randSpecs), None, None, bayessc)
-	self.conSpecs = conSpecs
-	self.randSpecs = randSpecs
-	
-    def __generatePOST(self, origParName, parData, observations, outdir, LPType = "U", PopType = "U"):
-	""" Iterate all observations in the Congruent group and execute BayeSSC using that particular observation data """
-	rows = []
-	for obs in observations:
-	    pre = len(rows)
-	    rows = self._commonExec(obs, parData, obs.getTime(), LPType, PopType, outdir, rows, False)
-	    if len(rows) != pre:
-		rows[-1].setNE(obs.getPop())
-		rows[-1].setMU(obs.getMutationRate())
-		rows[-1].setExpan(obs.getExpan())
-	if len(rows) != len(observations):
-	    raise BadBayesOutput("Did not generate an output for each observation")            
-	return rows	
-	
+    def __init__(self,options, par, conSpecs, randSpecs, bayessc):      
+        super(PostModel, self).__init__(options, par, None, len(conSpecs) + len(randSpecs), None, None, bayessc)
+        self.conSpecs = conSpecs
+        self.randSpecs = randSpecs
+        
+    def __generatePOST(self, origParName, parData, observations, outdir, repeats, LPType = "U", PopType = "U"):
+        """
+        Execute BayeSSC once for each observation of the group.  The accepted values pin every parameter,
+        so the par file of an observation is the same for all the trials: BayeSSC simulates it 'repeats' times in one run.
+        Returns a list of 'repeats' rows per observation.
+        """
+        simulations = []
+        for obs in observations:
+            chngtime, par = prepareNewParFile(obs, parData, obs.getTime(), LPType, PopType, False)
+            rows = self.bayessc.exceuteBateSSCWithRetry(obs, chngtime, par, outdir, repeats)
+            for row in rows:
+                row.setNE(obs.getPop())
+                row.setMU(obs.getMutationRate())
+                row.setExpan(obs.getExpan())
+            simulations.append(rows)
+        if len(simulations) != len(observations):
+            raise BadBayesOutput("Did not generate an output for each observation")            
+        return simulations     
+        
     def execute(self, modelNumber, hyperstatsOut = None, runDatOut = None):
         """
         a model describes how many observations make up the congruent group.  for instance, model0, means we have no congruent observations.
         This method is meant to contain all actions required to execute this script on a single model.  It will take that model, and
-        repeat the experiment multiple times, each time splitting the observations again and again.
+        repeat the experiment multiple times; trial i uses the i-th simulation of every observation.
         """
-        print >> sys.stderr , ".",
-        indx_raw = self.indx%(modelNumber, "_".join([str(random.random()), str(time.time())]).replace(".","_"))
-        for trial in xrange(int(self.options.repeats)):
+        print(".", end=" ", file=sys.stderr, flush=True)
+        indx_raw = self.indx%(modelNumber, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+        repeats = int(self.options.repeats)
+        conSims = []
+        randSims = []
+        if self.conSpecs:
+            conSims = self.__generatePOST(self.options.par, self.par, self.conSpecs, self.options.outdir, repeats)
+        if self.randSpecs:
+            randSims = self.__generatePOST(self.options.par, self.par, self.randSpecs, self.options.outdir, repeats)
+        for trial in range(repeats):
             outstr = []
-            conspecData= []
-            randomData= []
             indx = indx_raw%(trial)
-            if self.conSpecs:
-                rows = self.__generatePOST(self.options.par, self.par, self.conSpecs, self.options.outdir)
-                conspecData.extend(rows)
-                outstr.append( Model.FIELD_DELIM.join( map(str, rows) ) )
-            if self.randSpecs:
-                rows = self.__generatePOST(self.options.par, self.par, self.randSpecs, self.options.outdir)
-                randomData.extend(rows)
-                outstr.append( Model.FIELD_DELIM.join( map(str, rows) ) )
-
-	    print >> hyperstatsOut, Model.FIELD_DELIM.join( [indx] + computeStats(len(self.conSpecs), self.obsCnt, conspecData, randomData) )
+            conspecData = [rows[trial] for rows in conSims]
+            randomData = [rows[trial] for rows in randSims]
+            if conspecData:
+                outstr.append( Model.FIELD_DELIM.join( map(str, conspecData) ) )
+            if randomData:
+                outstr.append( Model.FIELD_DELIM.join( map(str, randomData) ) )
+
+            print(Model.FIELD_DELIM.join( [indx] + computeStats(len(self.conSpecs), self.obsCnt, conspecData, randomData) ), file=hyperstatsOut)
             if runDatOut:
-                print >> runDatOut, Model.FIELD_DELIM.join( [indx] + outstr)
-	
-	
+                print(Model.FIELD_DELIM.join( [indx] + outstr), file=runDatOut)
+            if self.status:
+                self.status.trialDone(modelNumber)
+
 
 def prepareNewParFile(obs, parData, time, LPType, PopType, modifyTime = True):
     """ populate the par object with the correct values.  Also modify the timestamp base on data from obs file """
     par = copy.copy(parData)
     if modifyTime:
-	chngtime = str( int( time / float(obs.gen)) )
-	par.setPopulation(PopType, obs.getPopRange())
-	par.setLociRate(LPType, obs.getMutationRange())
+        chngtime = str( int( time / obs.gen) )
+        par.setPopulation(PopType, obs.getPopRange())
+        par.setLociRate(LPType, obs.getMutationRange())
     else:
-	chngtime = str(time)
-	par.setStaticPop(obs.getPop())
-	par.setStaticLociRate(obs.getMutationRate())
-	par.setExpan(obs.getExpan())
+        chngtime = str(time)
+        par.setStaticPop(obs.getPop())
+        par.setStaticLociRate(obs.getMutationRate())
+        par.setExpan(obs.getExpan())
     par.setTime(chngtime)
     par.setgamma(obs.gamma)
     par.setSampleSize(obs.nsam)
@@ -787,9 +1949,9 @@ def parseObs(obs, ObsType = ObservationData):
     >species,nsam,nsites,tstv,gamma,gen,locuslow,locushigh,Nelow,Nehigh,SegSites,nucdiv,Haptypes,HapDiver,PairDiffs,TajimasD,F*,ExpHet   
     """
 
-    obsf = open(obs, "rU")
-    ObservationData.columns = map(string.strip, obsf.next().strip().lower().split("\t"))
-    obsl = [ObsType( dict( izip(ObservationData.columns, l.strip().split("\t")) ) ) for l in obsf]
+    obsf = open(obs, "r")
+    ObservationData.columns = [c.strip() for c in next(obsf).strip().lower().split("\t")]
+    obsl = [ObsType( dict( zip(ObservationData.columns, l.strip().split("\t")) ) ) for l in obsf]
     obsf.close()
     return obsl
 
@@ -815,7 +1977,7 @@ def which(program):
     return None
 
 
-def main_init(options, par):
+def main_init(options, par, status = None, policy = None):
     """
     main loop specific to the initial mode of the program
     """
@@ -823,60 +1985,637 @@ def main_init(options, par):
     obsCnt = len(observations)
     if options.makestats:
         obsStats = open(os.path.join(options.outdir,"hyperstats_observations.txt"), "w")
-        index = "%s_%s_%s_%s_%s"%(options.uid, -1, -1, -1, "_".join([str(random.random()), str(time.time())]).replace(".","_"))
-        print >> obsStats, Model.FIELD_DELIM.join( [index] + computeStats(0, obsCnt, obsData = observations) )
-	obsStats.close()
-    
-    hyperstats = open(os.path.join(options.outdir, "hyperstats_iterations_%s.txt"%(options.repeats)), "w")
-    runData = None
-    if not options.onlyHyperstats:
-	    runData = open(os.path.join(options.outdir, "run_data_iterations_%s.csv"%(options.repeats)), "w")
-    processor = Model(options, par, observations, obsCnt, ObservationSplitter("uniform"), TimeGenerator("uniform"), BayeSSC(options.bayesPath) )       
-    if options.model == None:
-	for modelNum in xrange(obsCnt + 1):	    
-	    processor.execute(modelNum, hyperstats, runData)
-	    if hyperstats:
-		hyperstats.flush()
-	    if runData:
-		runData.flush()
+        index = "%s_%s_%s_%s_%s"%(options.uid, -1, -1, -1, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+        print(Model.FIELD_DELIM.join( [index] + computeStats(0, obsCnt, obsData = observations) ), file=obsStats)
+        obsStats.close()
+
+    if options.writePlan:
+        models = range(obsCnt + 1)
+        if options.model != None:
+            models = [options.model]
+        seed = writeSimulationPlan(options.writePlan, observations, models, int(options.repeats), options.trange, options.seed)
+        print("Wrote %s units to plan '%s' (seed %s)" %(len(models) * int(options.repeats), options.writePlan, seed), file=sys.stderr)
+        return
+
+    suffix = ""
+    if options.plan and options.planUnits:
+        suffix = "_units_%s-%s"%(options.planUnits[0], options.planUnits[1])
+    rejection = None
+    if options.accept:
+        # only the closest trials are written, the column statistics are only used to scale the distances
+        obsValues = computeStats(0, obsCnt, obsData = observations)
+        observed = [float(obsValues[p - 1]) for p in options.acceptColumns]
+        if [v for v in observed if isnan(v) or isinf(v)]:
+            raise ValueError("The observations have no value for some of the --accept_columns")
+        scales = None
+        if options.acceptScaling:
+            scales = [sd for mean, sd in ColumnStats.forTable(options.acceptScaling, options.readWorkers).scaling(options.acceptColumns)]
+        columnStats = ColumnStats()
+        rejection = OnlineRejection(observed, options.acceptColumns, options.accept, options.priorSample, scales, columnStats, random.Random(options.seed))
+        hyperstatsName = os.path.join(options.outdir, "hyperstats_accepted_%s%s.txt"%(options.repeats, suffix))
+        hyperstats = open(hyperstatsName, "w")
+        runData = None
+        if not options.onlyHyperstats:
+            runData = open(os.path.join(options.outdir, "run_data_accepted_%s%s.csv"%(options.repeats, suffix)), "w")
     else:
-	processor.execute(options.model, hyperstats, runData)
-
-    hyperstats.close()
+        hyperstatsName = os.path.join(options.outdir, "hyperstats_iterations_%s%s.txt"%(options.repeats, suffix))
+        hyperstats, columnStats = openHyperstats(hyperstatsName, options.append, options.readWorkers)
+        runData = None
+        if not options.onlyHyperstats:
+                runData = open(os.path.join(options.outdir, "run_data_iterations_%s%s.csv"%(options.repeats, suffix)), "a" if options.append else "w")
+    alignments = None
+    if options.keepAlignments:
+        alignments = AlignmentStore(os.path.join(options.outdir, "alignments_iterations_%s%s"%(options.repeats, suffix)))
+    processor = Model(options, par, observations, obsCnt, ObservationSplitter("uniform"), TimeGenerator("uniform"), BayeSSC(options.bayesPath, options.retries, options.keepAlignments, status, policy, options.bayesTimeout), alignments, columnStats, rejection)
+    if options.plan:
+        plan = SimulationPlan(options.plan)
+        plan.checkObservations(observations)
+        start, end = 0, len(plan)
+        if options.planUnits:
+            start, end = options.planUnits
+        if status:
+            for unit in range(start, min(end, len(plan))):
+                status.addTotal(plan.models[unit // plan.repeats], 1)
+            status.start()
+        processor.executePlan(plan, start, end, hyperstats, runData)
+        plan.close()
+    elif options.model == None:
+        if status:
+            for modelNum in range(obsCnt + 1):
+                status.addTotal(modelNum, int(options.repeats))
+            status.start()
+        for modelNum in range(obsCnt + 1):         
+            processor.execute(modelNum, hyperstats, runData)
+            if hyperstats and not rejection:
+                hyperstats.flush()
+                columnStats.save(hyperstatsName)
+            if runData:
+                runData.flush()
+            if alignments:
+                alignments.flush()
+    else:
+        if status:
+            status.addTotal(options.model, int(options.repeats))
+            status.start()
+        processor.execute(options.model, hyperstats, runData)
+
+    if rejection:
+        priorOut = None
+        if options.priorSample:
+            priorOut = open(os.path.join(options.outdir, "hyperstats_prior_sample_%s%s.txt"%(options.repeats, suffix)), "w")
+        rejection.write(hyperstats, runData, priorOut)
+        if priorOut:
+            priorOut.close()
+        hyperstats.close()
+    else:
+        hyperstats.close()
+        columnStats.save(hyperstatsName)
     if runData:
-	runData.close()	
+        runData.close() 
+    if alignments:
+        alignments.close()
+
+
+def selectRuns(uidlst, run_dat, observations, workers = 1):
+    """
+    generator function that traverse the rundat file and returns a single hit at a time.
+    The rows are filtered by 'workers' processes (see mapRanges()).
+    """
+
+    uids = set([l.strip().split()[0] for l in open(uidlst, "r") if l.strip()])
+    for l in chain.from_iterable(mapRanges(rangeRows, run_dat, (uids,), workers)):
+        line = l.strip().split("\t")
+        uid = line[0]
+        line = line[1:]
+        obs = []
+        for r in  chunks(line, len(BayeSSCData.HEADERS)):
+            #HEADERS = ['species', 'nsam','nsites', 'haptype', 'segsites', 'pairdiffs', 'hapdiv', 'nucdiv', 'tajimasd', 'fusf','ne', 'expan', 'mu', 'time']
+            # every field of an observation is immutable, a shallow copy is enough
+            obj = copy.copy(observations[r[0]])
+            obj.setPop(r[10])
+            obj.setMutationRate(r[12])
+            obj.setExpan(r[11])
+            obj.setTime(r[13])
+            obs.append(obj)
+        model = indexModel(uid)
+        yield [ model, obs[:model], obs[model:] ]
+
+
+def parseManifest(manifest):
+    """
+    The batch manifest is a tab delimited file with one job per line: <observation file> <uid> <outdir>
+    Empty lines and lines starting with # are skipped.
+    """
+    jobs = []
+    for l in open(manifest, "r"):
+        if not l.strip() or l.startswith("#"):
+            continue
+        ls = l.rstrip("\n").split("\t")
+        if len(ls) != 3:
+            raise ValueError("Manifest line must be <observation file>\t<uid>\t<outdir>: '%s'" %(l.strip()))
+        jobs.append((ls[0], ls[1].replace(",","_").replace(" ",""), ls[2]))
+    return jobs
+
+
+def batchUnits(jobs, models, repeats):
+    """ generator over (job, model, trial), taking one unit of each job in turn so that every job progresses at the same pace """
+    def jobUnits(job):
+        for m in models(job):
+            for t in range(repeats):
+                yield job, m, t
+    units = [jobUnits(job) for job in jobs]
+    while units:
+        for it in list(units):
+            try:
+                yield next(it)
+            except StopIteration:
+                units.remove(it)
+
+
+def main_batch(options, par, status = None, policy = None):
+    """
+    main loop of the batch mode: every job of the manifest is an initial mode run of its own
+    observation file, and the trials of all the jobs share a single pool of worker threads.
+    """
+    seed = options.seed
+    if seed == None:
+        seed = random.randint(0, sys.maxsize)
+    jobs = []
+    sharing = {}
+    for jobId, (obsName, uid, outdir) in enumerate(parseManifest(options.manifest)):
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        observations = parseObs(obsName)
+        for obs in observations:
+            sharing.setdefault(observationSignature(obs), set()).add(jobId)
+        jobs.append((jobId, observations, uid, outdir))
+    cache = SimulationCache(sharing, options.cacheSize)
+    bayessc = BayeSSC(options.bayesPath, options.retries, status = status, policy = policy, timeout = options.bayesTimeout)
+    workdir = os.path.join(options.outdir, "batch_tmp")
+
+    models = {}
+    outputs = []
+    for jobId, observations, uid, outdir in jobs:
+        obsCnt = len(observations)
+        if options.makestats:
+            obsStats = open(os.path.join(outdir,"hyperstats_observations.txt"), "w")
+            index = "%s_%s_%s_%s_%s"%(uid, -1, -1, -1, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+            print(Model.FIELD_DELIM.join( [index] + computeStats(0, obsCnt, obsData = observations) ), file=obsStats)
+            obsStats.close()
+        hyperstatsName = os.path.join(outdir, "hyperstats_iterations_%s.txt"%(options.repeats))
+        hyperstats, columnStats = openHyperstats(hyperstatsName, options.append, options.readWorkers)
+        runData = None
+        if not options.onlyHyperstats:
+            runData = open(os.path.join(outdir, "run_data_iterations_%s.csv"%(options.repeats)), "a" if options.append else "w")
+        jobOptions = copy.copy(options)
+        jobOptions.uid = uid
+        jobOptions.outdir = outdir
+        models[jobId] = BatchModel(jobId, jobOptions, par, observations, bayessc, cache, seed, workdir, columnStats)
+        outputs.append((hyperstatsName, hyperstats, runData))
+        modelNums = range(obsCnt + 1)
+        if options.model != None:
+            modelNums = [options.model]
+        if status:
+            for modelNum in modelNums:
+                status.addTotal(modelNum, int(options.repeats))
+
+    def jobModels(jobId):
+        if options.model != None:
+            return [options.model]
+        return range(models[jobId].obsCnt + 1)
+
+    if status:
+        status.setWorkers(options.workers)
+        status.start()
+    pool = ThreadPoolExecutor(options.workers)
+    pending = set()
+    try:
+        for jobId, modelNum, trial in batchUnits(list(models.keys()), jobModels, int(options.repeats)):
+            if len(pending) >= 2 * options.workers:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for f in done:
+                    f.result()
+            hyperstatsName, hyperstats, runData = outputs[jobId]
+            pending.add(pool.submit(models[jobId].executeUnit, modelNum, trial, hyperstats, runData))
+        for f in pending:
+            f.result()
+    finally:
+        # cancel_futures of shutdown() needs python 3.9
+        for f in pending:
+            f.cancel()
+        pool.shutdown()
+        for jobId, (hyperstatsName, hyperstats, runData) in enumerate(outputs):
+            hyperstats.close()
+            models[jobId].columnStats.save(hyperstatsName)
+            if runData:
+                runData.close()
+    print("Reused %s of %s BayeSSC draws between jobs" %(cache.hits, cache.hits + cache.misses), file=sys.stderr)
+
+
+def workUnits(start, end, repeats, size):
+    """ split the plan units [start, end) into (start, end) work units of at most size plan units, a work unit never spans two models """
+    units = []
+    while start < end:
+        stop = min(end, start + size, (start // repeats + 1) * repeats)
+        units.append((start, stop))
+        start = stop
+    return units
+
+
+class QueueCoordinator(object):
+    """
+    Hands out the work units of a simulation plan to worker processes, and appends their results to the output files.
+
+    A work unit is leased for 'leaseTime' seconds and the worker renews the lease while it runs.  A lease that expires
+    (the worker died, or lost its host) puts the work unit back in the queue for the next worker.  A plan unit produces
+    the same parameters no matter which worker runs it, so the first result of a work unit is kept and a late one is dropped.
+    A result is only taken from the current lease of a work unit, or from its last expired lease.
+    Requests and replies are dicts, the same coordinator is served over a socket or a shared directory.
+    """
+    WAIT = 5.0
+
+    def __init__(self, plan, units, uid, leaseTime, hyperstatsName, hyperstats, runData = None, columnStats = None, status = None):
+        self.plan = plan
+        self.units = units
+        self.uid = uid
+        self.leaseTime = leaseTime
+        self.hyperstatsName = hyperstatsName
+        self.hyperstats = hyperstats
+        self.runData = runData
+        self.columnStats = columnStats
+        self.status = status
+        self.pending = deque(range(len(units)))
+        self.leases = {}
+        # last expired lease of a unit, its result is still taken
+        self.expired = {}
+        self.done = set()
+        self.issued = 0
+        self.lock = threading.Lock()
+
+    def handle(self, message):
+        with self.lock:
+            self.__expire()
+            op = message.get('op')
+            if op == 'lease':
+                return self.__lease(message['worker'])
+            elif op == 'renew':
+                return self.__renew(message['unit'], message['lease'])
+            elif op == 'complete':
+                if not isinstance(message['hyperstats'], str) or not isinstance(message.get('run_data', ""), str):
+                    return {'error': "The hyperstats and run_data of a complete request must be text"}
+                return self.__complete(message['unit'], message['lease'], message['hyperstats'], message.get('run_data', ""))
+            return {'error': "Unknown request '%s'" %(op)}
+
+    def finished(self):
+        with self.lock:
+            return len(self.done) == len(self.units)
+
+    def __expire(self):
+        now = time.time()
+        for unit, (worker, lease, expires) in list(self.leases.items()):
+            if expires < now:
+                print("Lease of work unit %s by %s expired, queued again" %(unit, worker), file=sys.stderr)
+                del self.leases[unit]
+                self.expired[unit] = lease
+                self.pending.appendleft(unit)
+                if self.status:
+                    self.status.workerIdle(worker)
+
+    def __lease(self, worker):
+        if len(self.done) == len(self.units):
+            return {'done': True}
+        if not self.pending:
+            # every unit left is leased, one may expire
+            return {'wait': min(QueueCoordinator.WAIT, self.leaseTime)}
+        unit = self.pending.popleft()
+        self.issued += 1
+        lease = "%s_%s"%(unit, self.issued)
+        self.leases[unit] = (worker, lease, time.time() + self.leaseTime)
+        if self.status:
+            self.status.workerBusy(worker)
+        start, end = self.units[unit]
+        return {'unit': unit, 'lease': lease, 'start': start, 'end': end, 'tag': self.plan.tag, 'uid': self.uid, 'lease_seconds': self.leaseTime}
+
+    def __renew(self, unit, lease):
+        held = self.leases.get(unit)
+        if held == None or held[1] != lease:
+            return {'ok': False}
+        self.leases[unit] = (held[0], lease, time.time() + self.leaseTime)
+        return {'ok': True}
+
+    def __complete(self, unit, lease, hyperstats, runData):
+        if unit in self.done:
+            return {'ok': False}
+        held = self.leases.get(unit)
+        if (held == None or held[1] != lease) and self.expired.get(unit) != lease:
+            return {'ok': False}
+        start, end = self.units[unit]
+        rows = hyperstats.splitlines()
+        if len(rows) != end - start:
+            return {'ok': False, 'error': "Work unit %s needs %s rows, got %s" %(unit, end - start, len(rows))}
+        self.leases.pop(unit, None)
+        self.expired.pop(unit, None)
+        if held == None and unit in self.pending:
+            # result of an expired lease, still valid
+            self.pending.remove(unit)
+        self.done.add(unit)
+        self.hyperstats.write(hyperstats)
+        self.hyperstats.flush()
+        if self.runData:
+            self.runData.write(runData)
+            self.runData.flush()
+        for row in rows:
+            ls = row.split(Model.FIELD_DELIM)
+            if self.columnStats:
+                self.columnStats.Push(ls[1:])
+            if self.status:
+                self.status.trialDone(indexModel(ls[0]))
+        if self.columnStats:
+            self.columnStats.save(self.hyperstatsName)
+        if self.status and held:
+            self.status.workerIdle(held[0])
+        return {'ok': True}
+
+
+def queueAddress(location):
+    """ (host, port) when the queue location is HOST:PORT, None when it is a shared directory """
+    host, sep, port = location.rpartition(":")
+    if sep and host and port.isdigit() and not os.path.isdir(location):
+        return (host, int(port))
+    return None
 
 
-def selectRuns(uidlst, run_dat, observations):
+class SocketQueueServer(object):
+    """ serves a QueueCoordinator on a TCP socket, each connection sends one JSON request line and reads one JSON reply line """
+    def __init__(self, coordinator, address):
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                try:
+                    reply = coordinator.handle(json.loads(line))
+                except Exception as e:
+                    print("Request from %s:%s failed: %r" %(self.client_address + (e,)), file=sys.stderr)
+                    reply = {'error': str(e)}
+                self.wfile.write((json.dumps(reply) + "\n").encode())
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(address, Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="queue")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def alive(self):
+        return self.thread.is_alive()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SocketQueueClient(object):
+    def __init__(self, address, timeout = 60.0):
+        self.address = address
+        self.timeout = timeout
+
+    def request(self, message):
+        """ send a request to the coordinator, retrying for 'timeout' seconds while it can not be reached """
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                conn = socket.create_connection(self.address, timeout = self.timeout)
+                try:
+                    conn.sendall((json.dumps(message) + "\n").encode())
+                    line = conn.makefile("rb").readline()
+                finally:
+                    conn.close()
+                if line:
+                    return json.loads(line)
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise IOError("Coordinator at %s:%s can not be reached" %(self.address))
+            time.sleep(1.0)
+
+
+class DirectoryQueueServer(object):
     """
-    generator function that traverse the rundat file and returns a single hit at a time
+    serves a QueueCoordinator through a shared directory: a worker writes each request to <dir>/inbox/<name>.json
+    and reads the reply from <dir>/outbox/<name>.json.  Files are written then renamed, so no partial file is read.
+    <dir>/finished is created once every work unit is done.
     """
+    def __init__(self, coordinator, path, poll = 0.5):
+        self.coordinator = coordinator
+        self.path = path
+        self.poll = poll
+        for sub in ("inbox", "outbox"):
+            if not os.path.isdir(os.path.join(path, sub)):
+                os.makedirs(os.path.join(path, sub))
+        if os.path.exists(os.path.join(path, "finished")):
+            os.remove(os.path.join(path, "finished"))
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name="queue")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __run(self):
+        inbox = os.path.join(self.path, "inbox")
+        while not self.stopEvent.wait(self.poll):
+            for name in sorted(os.listdir(inbox)):
+                if not name.endswith(".json"):
+                    continue
+                fpath = os.path.join(inbox, name)
+                try:
+                    reply = self.coordinator.handle(json.load(open(fpath, "r")))
+                except Exception as e:
+                    print("Request %s failed: %r" %(name, e), file=sys.stderr)
+                    reply = {'error': str(e)}
+                try:
+                    writeJSON(os.path.join(self.path, "outbox", name), reply)
+                    os.remove(fpath)
+                except OSError as e:
+                    print("Could not answer request %s: %s" %(name, e), file=sys.stderr)
+            if self.coordinator.finished():
+                try:
+                    open(os.path.join(self.path, "finished"), "w").close()
+                except OSError as e:
+                    print("Could not mark the queue finished: %s" %(e), file=sys.stderr)
+
+    def alive(self):
+        return self.thread.is_alive()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+
+
+class DirectoryQueueClient(object):
+    def __init__(self, path, worker, poll = 0.5, timeout = 60.0):
+        self.path = path
+        self.worker = worker
+        self.poll = poll
+        self.timeout = timeout
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def request(self, message):
+        """ write a request and wait for its reply, for 'timeout' seconds at most when no coordinator answers """
+        with self.lock:
+            self.sent += 1
+            name = "%s_%s.json"%(self.worker, self.sent)
+        inbox = os.path.join(self.path, "inbox")
+        outbox = os.path.join(self.path, "outbox", name)
+        deadline = time.time() + self.timeout
+        while not os.path.isdir(inbox):
+            if time.time() > deadline:
+                raise IOError("No coordinator is serving the queue directory '%s'" %(self.path))
+            time.sleep(self.poll)
+        writeJSON(os.path.join(inbox, name), message)
+        deadline = time.time() + self.timeout
+        while not os.path.exists(outbox):
+            if os.path.exists(os.path.join(self.path, "finished")) and message.get('op') == 'lease':
+                return {'done': True}
+            if time.time() > deadline:
+                raise IOError("No reply from the coordinator of the queue directory '%s'" %(self.path))
+            time.sleep(self.poll)
+        reply = json.load(open(outbox, "r"))
+        os.remove(outbox)
+        return reply
+
+
+def writeJSON(fpath, data):
+    """ write data to a temporary file and rename it, so a reader never sees a partial file """
+    tmp = "%s.tmp.%s"%(fpath, os.getpid())
+    out = open(tmp, "w")
+    json.dump(data, out)
+    out.close()
+    os.replace(tmp, fpath)
+
+
+class LeaseKeeper(object):
+    """ renews the lease of a work unit from a background thread while the unit runs """
+    def __init__(self, client, unit, lease, interval):
+        self.client = client
+        self.unit = unit
+        self.lease = lease
+        self.interval = interval
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.__run, name="lease")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __run(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.client.request({'op': 'renew', 'unit': self.unit, 'lease': self.lease})
+            except IOError:
+                # the coordinator is unreachable, the result is still sent when the unit is done
+                pass
 
-    uids = dict([(l.strip().split()[0], None,) for l in open(uidlst, "rU")])
-    rundat = open(run_dat, "rU")
-    for l in rundat:
-	line = l.strip().split("\t")
-	if line[0] not in uids:
-	    continue
-	uid = line[0]
-	line = line[1:]
-	obs = []
-	for r in  chunks(line, len(BayeSSCData.HEADERS)):
-	    record = dict(zip(BayeSSCData.HEADERS, r))
-	    #HEADERS = ['species', 'nsam','nsites', 'haptype', 'segsites', 'pairdiffs', 'hapdiv', 'nucdiv', 'tajimasd', 'fusf','ne', 'expan', 'mu', 'time']
-	    # perform a shallow copy or deepcopy??? deepcopy copy
-	    obj = copy.deepcopy(observations[record[BayeSSCData.HEADERS[0]]])
-	    obj.setPop(record[BayeSSCData.HEADERS[10]])
-	    obj.setMutationRate(record[BayeSSCData.HEADERS[12]])
-	    obj.setExpan(record[BayeSSCData.HEADERS[11]])
-	    obj.setTime(record[BayeSSCData.HEADERS[13]])
-	    obs.append(obj)
-	model = uid.split("_")[2]
-	model = int(model)
-	yield [ model, obs[:model], obs[model:] ]
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
 
 
-def main_post(options, par):
+def main_coordinator(options, status = None):
+    """
+    main loop of the coordinator mode: the units of a plan are handed out in work units to worker processes
+    (mode 'worker') and their rows are appended to the usual hyperstats and run data files.
+    """
+    plan = SimulationPlan(options.plan)
+    start, end = 0, len(plan)
+    suffix = ""
+    if options.planUnits:
+        start, end = options.planUnits[0], min(options.planUnits[1], len(plan))
+        suffix = "_units_%s-%s"%(options.planUnits[0], options.planUnits[1])
+    units = workUnits(start, end, plan.repeats, options.unitSize)
+    hyperstatsName = os.path.join(options.outdir, "hyperstats_iterations_%s%s.txt"%(plan.repeats, suffix))
+    hyperstats, columnStats = openHyperstats(hyperstatsName, options.append, options.readWorkers)
+    runData = None
+    if not options.onlyHyperstats:
+        runData = open(os.path.join(options.outdir, "run_data_iterations_%s%s.csv"%(plan.repeats, suffix)), "a" if options.append else "w")
+    coordinator = QueueCoordinator(plan, units, options.uid, options.lease, hyperstatsName, hyperstats, runData, columnStats, status)
+    if status:
+        for unit in range(start, end):
+            status.addTotal(plan.models[unit // plan.repeats], 1)
+        status.setWorkers(0)
+        status.start()
+    address = queueAddress(options.queue)
+    if address:
+        server = SocketQueueServer(coordinator, address)
+    else:
+        server = DirectoryQueueServer(coordinator, options.queue)
+    print("Serving %s work units on '%s'" %(len(units), options.queue), file=sys.stderr)
+    try:
+        while not coordinator.finished():
+            if not server.alive():
+                raise IOError("The server of the queue '%s' stopped" %(options.queue))
+            time.sleep(1.0)
+        # keep answering for a while, so the waiting workers learn that the queue is done
+        time.sleep(3 * QueueCoordinator.WAIT)
+    finally:
+        server.stop()
+        hyperstats.close()
+        columnStats.save(hyperstatsName)
+        if runData:
+            runData.close()
+        plan.close()
+
+
+def main_worker(options, par, status = None, policy = None):
+    """
+    main loop of the worker mode: lease work units from a coordinator until the queue is done,
+    run them from the plan and send the rows back.
+    """
+    observations = parseObs(options.obs)
+    plan = SimulationPlan(options.plan)
+    plan.checkObservations(observations)
+    worker = "%s_%s"%(socket.gethostname(), os.getpid())
+    address = queueAddress(options.queue)
+    if address:
+        client = SocketQueueClient(address)
+    else:
+        client = DirectoryQueueClient(options.queue, worker)
+    workerOptions = copy.copy(options)
+    workerOptions.outdir = os.path.join(options.outdir, "worker_%s"%(worker))
+    if not os.path.isdir(workerOptions.outdir):
+        os.makedirs(workerOptions.outdir)
+    bayessc = BayeSSC(options.bayesPath, options.retries, status = status, policy = policy, timeout = options.bayesTimeout)
+    if status:
+        status.start()
+    try:
+        while True:
+            try:
+                reply = client.request({'op': 'lease', 'worker': worker})
+            except IOError as e:
+                print("%s, stopping" %(e), file=sys.stderr)
+                break
+            if reply.get('done'):
+                break
+            if 'wait' in reply:
+                time.sleep(reply['wait'])
+                continue
+            if 'error' in reply or reply['tag'] != plan.tag:
+                raise ValueError(reply.get('error', "The coordinator serves a different plan than '%s'" %(options.plan)))
+            workerOptions.uid = reply['uid']
+            processor = Model(workerOptions, par, observations, len(observations), None, None, bayessc)
+            hyperstats = io.StringIO()
+            runData = io.StringIO()
+            keeper = LeaseKeeper(client, reply['unit'], reply['lease'], reply['lease_seconds'] / 3.0)
+            try:
+                processor.executePlan(plan, reply['start'], reply['end'], hyperstats, runData)
+            finally:
+                keeper.stop()
+            done = client.request({'op': 'complete', 'unit': reply['unit'], 'lease': reply['lease'],
+                                   'hyperstats': hyperstats.getvalue(), 'run_data': runData.getvalue()})
+            if not done.get('ok'):
+                print("Result of work unit %s was not used: %s" %(reply['unit'], done.get('error', "already completed by another worker")), file=sys.stderr)
+    finally:
+        plan.close()
+
+
+def main_post(options, par, status = None, policy = None):
     """
     main loop specific to the posterior mode of the program
     """
@@ -888,16 +2627,22 @@ def main_post(options, par):
     hyperstats = open(os.path.join(options.outdir, "post_hyperstats_iterations_%s.txt"%(options.repeats)), "w")
     runData = None
     if not options.onlyHyperstats:
-	    runData = open(os.path.join(options.outdir, "post_run_data_iterations_%s.csv"%(options.repeats)), "w")
-
+            runData = open(os.path.join(options.outdir, "post_run_data_iterations_%s.csv"%(options.repeats)), "w")
+
+    if status:
+        for l in open(options.uidlst, "r"):
+            if l.strip():
+                status.addTotal(indexModel(l.split()[0]), int(options.repeats))
+        status.start()
+    bayessc = BayeSSC(options.bayesPath, options.retries, status = status, policy = policy, timeout = options.bayesTimeout)
     #TODO: parse the run_data and the UID list to select what to process
-    for model, conSpecs, randSpecs in selectRuns(options.uidlst, options.run_dat, observation_dict):
-	#index = "%s_%s_%s_%s_%s"%(options.uid, -1, -1, -1, "_".join([str(random.random()), str(time.time())]).replace(".","_"))
-	processor = PostModel(options, par, conSpecs, randSpecs, BayeSSC(options.bayesPath) )          
-	processor.execute(model, hyperstats, runData)
+    for model, conSpecs, randSpecs in selectRuns(options.uidlst, options.run_dat, observation_dict, options.readWorkers):
+        #index = "%s_%s_%s_%s_%s"%(options.uid, -1, -1, -1, "_".join([formatValue(random.random()), formatValue(time.time())]).replace(".","_"))
+        processor = PostModel(options, par, conSpecs, randSpecs, bayessc)
+        processor.execute(model, hyperstats, runData)
     hyperstats.close()
     if runData:
-	runData.close()	
+        runData.close() 
 
 
 def main():
@@ -906,44 +2651,172 @@ def main():
     drives how the program executes (only 1 model, or multiple models).
     """
     options = commandlineArgs()
-    par = ParFile(options.par)
-    if options.mode == 'initial':
-	main_init(options, par)
-    elif options.mode == 'posterior':
-	main_post(options, par)
-    else:
-	pass
+    par = None
+    if options.par:
+        par = ParFile(options.par)
+    status = None
+    if options.statusFile:
+        status = RunStatus(options.statusFile, options.statusInterval)
+    policy = FailurePolicy(options.onFailure, options.maxFailureRate, options.minAttempts, options.quarantine, options.quarantineSize, status)
+    state = "failed"
+    try:
+        if options.mode == 'initial':
+            main_init(options, par, status, policy)
+        elif options.mode == 'posterior':
+            main_post(options, par, status, policy)
+        elif options.mode == 'batch':
+            main_batch(options, par, status, policy)
+        elif options.mode == 'coordinator':
+            main_coordinator(options, status)
+        elif options.mode == 'worker':
+            main_worker(options, par, status, policy)
+        else:
+            pass
+        state = "finished"
+    except TooManyFailures as e:
+        print("\n%s, stopping" %(e), file=sys.stderr)
+        sys.exit(1)
+    except BadBayesOutput as e:
+        print("\n%s, stopping" %(e.val.rstrip(".")), file=sys.stderr)
+        sys.exit(1)
+    finally:
+        policy.report()
+        if status:
+            status.stop(state)
 
 
 def mode_init(parser, options, args):
+    if options.accept != None:
+        if options.accept < 1 or options.priorSample < 0:
+            parser.print_help()
+            parser.error("--accept must be at least 1 and --prior_sample can not be negative")
+        if options.append:
+            parser.print_help()
+            parser.error("--accept and --append cannot be used together")
+        if options.acceptScaling and not os.path.isfile(options.acceptScaling):
+            parser.print_help()
+            parser.error("Scaling file not found: '%s'" %(options.acceptScaling))
+        try:
+            options.acceptColumns = resolveColumns(options.acceptColumns.split(","))
+        except ValueError as e:
+            parser.print_help()
+            parser.error(str(e))
+        if not os.path.isfile(options.obs):
+            parser.print_help()
+            parser.error("Observation file not found: '%s'" %(options.obs))
+        # the distances need an observed value in every column, a column of the observation file may be missing
+        observations = parseObs(options.obs)
+        obsValues = computeStats(0, len(observations), obsData = observations)
+        missing = [p for p in options.acceptColumns if skipNanInf(obsValues[p - 1])]
+        if missing:
+            names = ", ".join([statsHeader()[p - 1] for p in missing])
+            if options.acceptColumns != resolveColumns(parser.defaults['acceptColumns'].split(",")):
+                parser.print_help()
+                parser.error("The observations have no value for the --accept_columns %s" %(names))
+            options.acceptColumns = [p for p in options.acceptColumns if p not in missing]
+            if not options.acceptColumns:
+                parser.print_help()
+                parser.error("The observations have no value for any of the default --accept_columns")
+            print("The observations have no value for %s, --accept uses the other columns" %(names), file=sys.stderr)
+    if options.plan:
+        if options.writePlan:
+            parser.print_help()
+            parser.error("--plan and --write_plan cannot be used together")
+        if not os.path.isfile(options.plan):
+            parser.print_help()
+            parser.error("Plan file not found: '%s'" %(options.plan))
+        try:
+            plan = SimulationPlan(options.plan)
+        except ValueError as e:
+            parser.print_help()
+            parser.error(str(e))
+        plan.close()
+        # the output files are named after the repeats, which are those of the plan (the coordinator and workers take no -r)
+        if options.repeats != None and options.repeats != plan.repeats:
+            parser.print_help()
+            parser.error("The plan '%s' has %s repeats, not the %s of -r" %(options.plan, plan.repeats, options.repeats))
+        if options.planUnits:
+            try:
+                options.planUnits = list(map(int, options.planUnits.split(":")))
+            except ValueError:
+                parser.print_help()
+                parser.error("Plan units must be provided in the following format:  <start>:<end> Example: 0:1000")
+            if len(options.planUnits) != 2 or options.planUnits[0] < 0 or options.planUnits[0] > options.planUnits[1]:
+                parser.print_help()
+                parser.error("Plan units must be provided in the following format:  <start>:<end> Example: 0:1000")
+        # the time range is stored in the plan
+        return (options, args,)
     if not options.trange:
-	parser.print_help()
-	parser.error("Time range is required")
+        parser.print_help()
+        parser.error("Time range is required")
     if options.trange.find(".") != -1:
-	parser.print_help()
-	parser.error("Time range must consist of only integers")
+        parser.print_help()
+        parser.error("Time range must consist of only integers")
     options.trange = options.trange.split(":")
     if len(options.trange) != 2:
-	parser.print_help()
-	parser.error("Time range  must be provided in the following format:  <lowerbounds>:<upperbounds> Example: 1000:20000")
+        parser.print_help()
+        parser.error("Time range  must be provided in the following format:  <lowerbounds>:<upperbounds> Example: 1000:20000")
     try:
-	options.trange = map(int, options.trange)
+        options.trange = list(map(int, options.trange))
     except:
-	parser.print_help()
-	parser.error("Time range does not consist of valid integers")  
+        parser.print_help()
+        parser.error("Time range does not consist of valid integers")  
     return (options, args,)
     
 
+def mode_batch(parser, options, args):
+    if not options.manifest:
+        parser.print_help()
+        parser.error("Manifest file is required")
+    if not os.path.isfile(options.manifest):
+        parser.print_help()
+        parser.error("Manifest file not found: '%s'" %(options.manifest))
+    if options.workers < 1:
+        parser.print_help()
+        parser.error("At least 1 worker is required")
+    if options.plan or options.writePlan or options.keepAlignments or options.accept:
+        parser.print_help()
+        parser.error("--plan, --write_plan, --keep_alignments and --accept are not available in batch mode")
+    return mode_init(parser, options, args)
+
+
+def mode_coordinator(parser, options, args):
+    if not options.plan:
+        parser.print_help()
+        parser.error("A plan file is required")
+    if not options.queue:
+        parser.print_help()
+        parser.error("A queue directory or HOST:PORT is required")
+    if options.unitSize < 1 or options.lease <= 0:
+        parser.print_help()
+        parser.error("--unit_size and --lease must be positive")
+    if options.accept:
+        parser.print_help()
+        parser.error("--accept is not available in modes 'coordinator' and 'worker'")
+    return mode_init(parser, options, args)
+
+
+def mode_worker(parser, options, args):
+    if options.writePlan or options.keepAlignments:
+        parser.print_help()
+        parser.error("--write_plan and --keep_alignments are not available in worker mode")
+    if options.onFailure == 'redraw':
+        # the coordinator only takes a plan unit back with all of its rows
+        parser.print_help()
+        parser.error("--on_failure redraw is not available in worker mode")
+    return mode_coordinator(parser, options, args)
+
+
 def mode_post(parser, options, args):
     if not options.uidlst:
-	parser.print_help()
-	parser.error("UID list file is required")
+        parser.print_help()
+        parser.error("UID list file is required")
     if not options.run_dat:
-	parser.print_help()
-	parser.error("Run data file is required")  
+        parser.print_help()
+        parser.error("Run data file is required")  
     return (options, args,)
     
-	
+        
 def commandlineArgs():
     """
     Command line arguments for this script.  It also provides some validation on the arguments passed in, to make sure we have some type of chance to actually succeede.
@@ -951,7 +2824,7 @@ def commandlineArgs():
     global BAYESSC_PATH
     parser = OptionParser("%prog [options]")
 
-    parser.add_option("", "--mode", dest = "mode", help = "program operation mode [ 'initial', 'posterior' ] [required]", action = "store", type = "choice", choices = [ 'initial', 'posterior' ] )
+    parser.add_option("", "--mode", dest = "mode", help = "program operation mode [ 'initial', 'posterior', 'batch', 'coordinator', 'worker' ] [required]", action = "store", type = "choice", choices = [ 'initial', 'posterior', 'batch', 'coordinator', 'worker' ] )
     parser.add_option("-p", "--par", dest = "par", help = "par file template [required]", action = "store", type = "string", metavar = "FILE")
     parser.add_option("-i", "--obs", dest = "obs", help = "Observation file [required]", action = "store", type = "string", metavar = "FILE")
     parser.add_option("-r", "--repeat", dest = "repeats", help = "Number of times to try a given congruent group size [required]", action = "store", type = "int", metavar = "NUM")
@@ -959,18 +2832,47 @@ def commandlineArgs():
     parser.add_option("-b", "--bayepath", dest = "bayesPath", help = "Path to BayeSSC application [default: Located on user PATH]", action = "store", type = "string", metavar = "PATH", default = "BayeSSC")
     parser.add_option("", "--only_hyperstats", action="store_true", dest="onlyHyperstats", default=False, help="When set, will only generate the hyperstats file")
     parser.add_option("", "--print_headers", action="store_true", dest="headers", default=False, help="When set will generate a headers.txt and exit")
+    parser.add_option("", "--status_file", dest = "statusFile", help = "JSON file rewritten every --status_interval seconds with the progress of the run [default: no status file]", action = "store", type = "string", metavar = "FILE", default = None)
+    parser.add_option("", "--status_interval", dest = "statusInterval", help = "Seconds between updates of the --status_file [default: %default]", action = "store", type = "float", metavar = "SECONDS", default = 5.0)
+    parser.add_option("", "--read_workers", dest = "readWorkers", help = "Number of processes parsing the large tables read by a run (the --run_data, and hyperstats files whose column statistics must be computed) [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
     parser.add_option("-o", "--outdir", dest = "outdir", help = "Directory to generate final outputs in (will create missing folders) [default: %default]", action = "store", type = "string", metavar = "PATH", default = os.getcwd())
 
 
-    init_group = OptionGroup(parser, "Regular Run", "Options to be applied during mode 'initial'")
+    init_group = OptionGroup(parser, "Regular Run", "Options to be applied during mode 'initial' (and 'batch')")
     
     init_group.add_option("-m", "--model", dest = "model", help = "Run a single model (0 to total entries in observation file) [default: run all models] ", action = "store", type = "int", metavar = "MODEL", default = None)
     init_group.add_option("-l", "--LPType", dest = "LPType", help = "Loci Rate Priori Type", action = "store", type = "choice", choices = ["U"], default = "U", metavar = "TYPE")
     init_group.add_option("-t", "--timerange", dest= "trange", help = "The range of values to select the time from (Integers). Example: 1000:20000  [required]", action = "store", type = "string", metavar ="RANGE")
     init_group.add_option("", "--obs_stats", action="store_true", dest="makestats", default=False, help="When set, will generate a statistics output for the observation data")
+    init_group.add_option("", "--append", action="store_true", dest="append", default=False, help="When set, the rows are appended to the output files of an earlier run with the same options and the column statistics of the hyperstats are merged")
+    init_group.add_option("", "--accept", dest = "accept", help = "Reject while simulating: only write the NUM trials closest to the observations (and a prior sample) instead of every trial.  Without --accept_scaling the distances are scaled as the trials come, so the NUM trials are only approximately the closest ones [default: write every trial]", action = "store", type = "int", metavar = "NUM", default = None)
+    init_group.add_option("", "--accept_columns", dest = "acceptColumns", help = "Comma separated hyperstats columns (names or msReject column numbers) used by --accept [default: haptypes_Mean to segsites_Kurtosis, without the columns the observations have no value for]", action = "store", type = "string", metavar = "COLS", default = ",".join(statsHeader()[statsHeader().index('haptypes_Mean'):]))
+    init_group.add_option("", "--accept_scaling", dest = "acceptScaling", help = "Hyperstats file (for instance a pilot run) whose column statistics scale the --accept distances [default: the running statistics of the trials]", action = "store", type = "string", metavar = "FILE", default = None)
+    init_group.add_option("", "--prior_sample", dest = "priorSample", help = "Number of hyperstats rows kept as a uniform prior sample with --accept [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1000)
+    init_group.add_option("", "--keep_alignments", action="store_true", dest="keepAlignments", default=False, help="When set, the sequences simulated by BayeSSC are kept in a bit packed store per species (see tools/alignment_stats.py)")
+    init_group.add_option("", "--write_plan", dest = "writePlan", help = "Draw the species split and times of every (model, trial) up front, write them to FILE and exit", action = "store", type = "string", metavar = "FILE", default = None)
+    init_group.add_option("", "--seed", dest = "seed", help = "Random seed used by --write_plan and the batch mode [default: random]", action = "store", type = "int", metavar = "NUM", default = None)
+    init_group.add_option("", "--plan", dest = "plan", help = "Execute the units of a plan generated by --write_plan instead of drawing values during the run", action = "store", type = "string", metavar = "FILE", default = None)
+    init_group.add_option("", "--plan_units", dest = "planUnits", help = "Only execute the plan units START:END (0 based, END excluded) [default: all units]", action = "store", type = "string", metavar = "RANGE", default = None)
 
     parser.add_option_group(init_group)    
 
+    batch_group = OptionGroup(parser, "Batch Run", "Options to be applied during mode 'batch'.  Every job is an initial run, -i and -u come from the manifest")
+
+    batch_group.add_option("", "--manifest", dest = "manifest", help = "Tab delimited file with one job per line: <observation file> <uid> <outdir> [required]", action = "store", type = "string", metavar = "FILE", default = None)
+    batch_group.add_option("", "--workers", dest = "workers", help = "Number of BayeSSC runs executed at the same time [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    batch_group.add_option("", "--cache_size", dest = "cacheSize", help = "Maximum number of BayeSSC draws held for reuse by other jobs [default: %default]", action = "store", type = "int", metavar = "NUM", default = 10000)
+
+    parser.add_option_group(batch_group)
+
+    queue_group = OptionGroup(parser, "Distributed Run", "Options to be applied during modes 'coordinator' and 'worker'.  Both need --plan, the coordinator hands the plan units out to the workers")
+
+    queue_group.add_option("", "--queue", dest = "queue", help = "Shared directory, or HOST:PORT of the coordinator socket, used to hand out the work [required]", action = "store", type = "string", metavar = "LOCATION", default = None)
+    queue_group.add_option("", "--unit_size", dest = "unitSize", help = "Number of plan units (trials of a single model) in a work unit [default: %default]", action = "store", type = "int", metavar = "NUM", default = 10)
+    queue_group.add_option("", "--lease", dest = "lease", help = "Seconds a worker holds a work unit without renewing it before it is handed to another worker [default: %default]", action = "store", type = "float", metavar = "SECONDS", default = 600.0)
+
+    parser.add_option_group(queue_group)
+
     post_group = OptionGroup(parser, "Posterior Run", "Options to be applied during mode 'posterior'")   
 
     post_group.add_option("", "--uid_list", action="store", dest="uidlst", default="", type = "string", metavar = "FILE", help="Speccifies a list of UIDs to filter on for Posterior processing [required]")
@@ -978,57 +2880,88 @@ def commandlineArgs():
 
     parser.add_option_group(post_group)    
 
+    failure_group = OptionGroup(parser, "BayeSSC Failures", "What is done when a BayeSSC run fails (exits with an error, times out or writes an incomplete output)")
+
+    failure_group.add_option("", "--retries", dest = "retries", help = "Number of times a par file is run before its simulation fails [default: %default]", action = "store", type = "int", metavar = "NUM", default = 10)
+    failure_group.add_option("", "--on_failure", dest = "onFailure", help = "What a failed run leads to [ 'retry': run the par file again, 'backoff': run it again after waiting 1, 2, 4 ... seconds, 'redraw': after --retries, give the trial up (and draw a new one when the trial was not planned) ] [default: %default]", action = "store", type = "choice", choices = FailurePolicy.ACTIONS, metavar = "ACTION", default = "retry")
+    failure_group.add_option("", "--bayessc_timeout", dest = "bayesTimeout", help = "Seconds a BayeSSC run may take before it is killed and counted as failed [default: no limit]", action = "store", type = "float", metavar = "SECONDS", default = None)
+    failure_group.add_option("", "--max_failure_rate", dest = "maxFailureRate", help = "Stop the run as soon as the runs of a species fail at this rate (after --min_attempts runs, or when a par file used its --retries) [default: %default]", action = "store", type = "float", metavar = "RATE", default = 0.5)
+    failure_group.add_option("", "--min_attempts", dest = "minAttempts", help = "Number of runs of a species before its failure rate is checked [default: %default]", action = "store", type = "int", metavar = "NUM", default = 20)
+    failure_group.add_option("", "--quarantine", dest = "quarantine", help = "Directory the par file and stderr of failed runs are copied to [default: not kept]", action = "store", type = "string", metavar = "PATH", default = None)
+    failure_group.add_option("", "--quarantine_size", dest = "quarantineSize", help = "Number of the latest failed runs kept in --quarantine [default: %default]", action = "store", type = "int", metavar = "NUM", default = 100)
+
+    parser.add_option_group(failure_group)
+
     (options, args) = parser.parse_args()    
 
     if options.headers:
-	 print "Generating header file"
-	 bayshdr = ['index'] + BayeSSCData().header()
-	 hyperhdr = ['index'] + statsHeader()
-	 o = open("headers.txt", "w")
-	 print >> o , "Iteration file header"
-	 print >> o, Model.FIELD_DELIM.join(bayshdr)
-	 print >> o, "\nHyperstats file header"
-	 print >> o, Model.FIELD_DELIM.join(hyperhdr)
-	 o.close()
-	 sys.exit()
-
-
-    if not options.par:
-	parser.print_help()
-	parser.error("par file is required")
-    if not options.obs:
-	parser.print_help()
-	parser.error("observation file is required")
-    if not options.repeats:
-	parser.print_help()
-	parser.error("Number of repeats is required")
-    if not options.uid:
-	parser.print_help()
-	parser.error("A Unique ID is required")
+         print("Generating header file")
+         bayshdr = ['index'] + BayeSSCData().header()
+         hyperhdr = ['index'] + statsHeader()
+         o = open("headers.txt", "w")
+         print("Iteration file header", file=o)
+         print(Model.FIELD_DELIM.join(bayshdr), file=o)
+         print("\nHyperstats file header", file=o)
+         print(Model.FIELD_DELIM.join(hyperhdr), file=o)
+         o.close()
+         sys.exit()
+
+
+    if not options.par and options.mode != 'coordinator':
+        parser.print_help()
+        parser.error("par file is required")
+    if not options.obs and options.mode not in ('batch', 'coordinator'):
+        parser.print_help()
+        parser.error("observation file is required")
+    if not options.repeats and options.mode not in ('coordinator', 'worker'):
+        parser.print_help()
+        parser.error("Number of repeats is required")
+    if not options.uid and options.mode not in ('batch', 'worker'):
+        parser.print_help()
+        parser.error("A Unique ID is required")
+    if options.readWorkers < 1:
+        parser.print_help()
+        parser.error("At least 1 read worker is required")
+    if options.retries < 1 or options.minAttempts < 1 or options.quarantineSize < 0:
+        parser.print_help()
+        parser.error("--retries and --min_attempts must be at least 1 and --quarantine_size can not be negative")
+    if not 0 < options.maxFailureRate <= 1:
+        parser.print_help()
+        parser.error("--max_failure_rate must be between 0 and 1")
+    if options.bayesTimeout != None and options.bayesTimeout <= 0:
+        parser.print_help()
+        parser.error("--bayessc_timeout must be positive")
     if os.path.exists(options.outdir) and  not os.path.isdir(options.outdir):
-	parser.print_help()
-	parser.error("Output path exists, but is not a directory")
+        parser.print_help()
+        parser.error("Output path exists, but is not a directory")
     if not os.path.exists(options.outdir):
-	try:
-	    os.makedirs(options.outdir)
-	except OSError:
-	    parser.print_help()
-	    parser.error("Output path cannot be created")
-    		   
-    options.uid = options.uid.replace(",","_").replace(" ","")
+        try:
+            os.makedirs(options.outdir)
+        except OSError:
+            parser.print_help()
+            parser.error("Output path cannot be created")
+                   
+    if options.uid:
+        options.uid = options.uid.replace(",","_").replace(" ","")
     BAYESSC_PATH = which(options.bayesPath)
-    if not BAYESSC_PATH:
-	parser.print_help()
-	parser.error("BayeSSC application not found at supplied path: '%s'" %(options.bayesPath))
+    if not BAYESSC_PATH and options.mode != 'coordinator':
+        parser.print_help()
+        parser.error("BayeSSC application not found at supplied path: '%s'" %(options.bayesPath))
 
     if options.mode == 'initial':
-	options, args = mode_init(parser, options, args)
+        options, args = mode_init(parser, options, args)
     elif options.mode == 'posterior':
-	options, args = mode_post(parser, options, args)
+        options, args = mode_post(parser, options, args)
+    elif options.mode == 'batch':
+        options, args = mode_batch(parser, options, args)
+    elif options.mode == 'coordinator':
+        options, args = mode_coordinator(parser, options, args)
+    elif options.mode == 'worker':
+        options, args = mode_worker(parser, options, args)
     else:
-	parser.print_help()
-	parser.error("Mode must be either 'initial' or 'posterior'")
-	
+        parser.print_help()
+        parser.error("Mode must be either 'initial', 'posterior', 'batch', 'coordinator' or 'worker'")
+        
     return options
 
 
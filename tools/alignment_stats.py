@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import sys
+import os
+import glob
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import AlignmentStore
+
+
+"""
+Summary statistics computed directly from the alignments kept with 'hBayeSSC.py --keep_alignments'.
+
+All the alignments of a species have the same number of sequences and sites, so they are
+unpacked into a single (alignments, sequences, sites) array and every statistic is computed
+for the whole batch at once.  Adding a statistic only needs a pass over the alignment store,
+not a new reference table.
+"""
+
+STATS = ['segsites', 'pairdiffs', 'nucdiv', 'haptypes', 'hapdiv', 'tajimasd', 'fusf', 'r2']
+
+
+def unpack(packed, nsam, nsites):
+    """ unpack the 2 bit bases of a list of packed alignments into a uint8 array of shape (alignments, nsam, nsites) """
+    raw = np.frombuffer(b"".join(packed), dtype=np.uint8).reshape(len(packed), -1)
+    codes = np.empty((raw.shape[0], raw.shape[1] * 4), dtype=np.uint8)
+    for i, shift in enumerate((6, 4, 2, 0)):
+        codes[:, i::4] = (raw >> shift) & 3
+    return codes[:, :nsam * nsites].reshape(-1, nsam, nsites)
+
+
+def readBatches(filePath, batchSize = 1000):
+    """ generator that returns (indices, alignments) with at most batchSize alignments per batch """
+    indices = []
+    packed = []
+    shape = None
+    for indx, nsam, nsites, bases in AlignmentStore.read(filePath):
+        if shape != None and (nsam, nsites) != shape or len(packed) == batchSize:
+            yield indices, unpack(packed, shape[0], shape[1])
+            indices = []
+            packed = []
+        shape = (nsam, nsites)
+        indices.append(indx)
+        packed.append(bases)
+    if packed:
+        yield indices, unpack(packed, shape[0], shape[1])
+
+
+def baseCounts(aln):
+    """ number of copies of each base at each site, shape (alignments, 4, nsites) """
+    return np.stack([(aln == b).sum(axis=1) for b in range(4)], axis=1)
+
+
+def segregatingSites(counts):
+    return ((counts > 0).sum(axis=1) > 1).sum(axis=1)
+
+
+def pairwiseDifferences(counts, nsam):
+    """ average number of differences between two sequences """
+    pairs = nsam * (nsam - 1) / 2.0
+    diffs = (nsam * nsam - (counts.astype(np.float64) ** 2).sum(axis=1)) / 2.0
+    return diffs.sum(axis=1) / pairs
+
+
+def haplotypeCounts(aln):
+    """ copies of every distinct haplotype, shape (alignments, nsam), padded with zeros """
+    m, nsam, nsites = aln.shape
+    rows = np.ascontiguousarray(aln).view(np.dtype((np.void, nsites))).reshape(m, nsam)
+    rows = np.sort(rows, axis=1)
+    newHap = np.ones((m, nsam), dtype=bool)
+    newHap[:, 1:] = rows[:, 1:] != rows[:, :-1]
+    hapId = np.cumsum(newHap, axis=1) - 1 + (np.arange(m) * nsam)[:, None]
+    return np.bincount(hapId.ravel(), minlength=m * nsam).reshape(m, nsam)
+
+
+def haplotypeDiversity(hapCounts, nsam):
+    freq = hapCounts / float(nsam)
+    return nsam / (nsam - 1.0) * (1.0 - (freq ** 2).sum(axis=1))
+
+
+def tajimasD(segsites, pairdiffs, nsam):
+    i = np.arange(1, nsam, dtype=np.float64)
+    a1 = (1.0 / i).sum()
+    a2 = (1.0 / i ** 2).sum()
+    b1 = (nsam + 1.0) / (3.0 * (nsam - 1.0))
+    b2 = 2.0 * (nsam * nsam + nsam + 3.0) / (9.0 * nsam * (nsam - 1.0))
+    c1 = b1 - 1.0 / a1
+    c2 = b2 - (nsam + 2.0) / (a1 * nsam) + a2 / (a1 * a1)
+    e1 = c1 / a1
+    e2 = c2 / (a1 * a1 + a2)
+    S = segsites.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        D = (pairdiffs - S / a1) / np.sqrt(e1 * S + e2 * S * (S - 1.0))
+    D[S == 0] = np.nan
+    return D
+
+
+def logStirling(nsam):
+    """ log of the unsigned stirling numbers of the first kind |s(nsam, k)| for k = 0 .. nsam """
+    logs = np.full(nsam + 1, -np.inf)
+    logs[0] = 0.0
+    for n in range(1, nsam + 1):
+        nxt = np.full(nsam + 1, -np.inf)
+        # |s(n, k)| = |s(n-1, k-1)| + (n-1) |s(n-1, k)|
+        with np.errstate(divide='ignore'):
+            nxt[1:] = np.logaddexp(logs[:-1], logs[1:] + np.log(n - 1.0))
+        logs = nxt
+    return logs
+
+
+def fusFs(haptypes, pairdiffs, nsam, logS = None):
+    """
+    Fu's Fs = ln(S' / (1 - S')) where S' is the probability of seeing at least the observed
+    number of haplotypes under the Ewens sampling formula with theta estimated from the pairwise differences.
+    The two tails are summed separately in log space so that S' close to 1 keeps its precision.
+    """
+    if logS is None:
+        logS = logStirling(nsam)
+    k = np.arange(1, nsam + 1)
+    theta = np.asarray(pairdiffs, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = logS[1:][None, :] + k[None, :] * np.log(theta)[:, None]
+        atLeast = k[None, :] >= np.asarray(haptypes)[:, None]
+        upper = np.logaddexp.reduce(np.where(atLeast, terms, -np.inf), axis=1)
+        lower = np.logaddexp.reduce(np.where(atLeast, -np.inf, terms), axis=1)
+        Fs = upper - lower
+    Fs[~(theta > 0)] = np.nan
+    return Fs
+
+
+def ramosOnsinsR2(aln, counts, segsites, pairdiffs):
+    """ R2 of Ramos-Onsins and Rozas (2002), built from the singletons carried by each sequence """
+    carried = np.take_along_axis(counts, aln, axis=1)
+    singletons = (carried == 1).sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R2 = np.sqrt(((singletons - pairdiffs[:, None] / 2.0) ** 2).mean(axis=1)) / segsites
+    R2[segsites == 0] = np.nan
+    return R2
+
+
+def foldedSFS(counts, nsam):
+    """
+    folded site frequency spectrum of the biallelic sites, column i holds the number of sites with a minor allele count of i + 1.
+    Sites with 3 or 4 bases (possible under the finite sites model of BayeSSC) have no single minor allele and are left out.
+
+    >>> counts = np.array([[[4, 2, 5, 3], [1, 2, 0, 2], [0, 1, 0, 0], [0, 0, 0, 0]]])
+    >>> foldedSFS(counts, 5)
+    array([[1, 1]])
+    """
+    biallelic = (counts > 0).sum(axis=1) == 2
+    minor = np.where(biallelic, nsam - counts.max(axis=1), 0)
+    m = counts.shape[0]
+    sfs = np.zeros((m, nsam // 2 + 1), dtype=np.int64)
+    np.add.at(sfs, (np.repeat(np.arange(m), minor.shape[1]), minor.ravel()), 1)
+    return sfs[:, 1:]
+
+
+def computeAlignmentStats(aln, logS = None):
+    """ every statistic of STATS (plus the folded sfs) for a batch of alignments """
+    m, nsam, nsites = aln.shape
+    counts = baseCounts(aln)
+    stats = {}
+    stats['segsites'] = segregatingSites(counts)
+    stats['pairdiffs'] = pairwiseDifferences(counts, nsam)
+    stats['nucdiv'] = stats['pairdiffs'] / nsites
+    hapCounts = haplotypeCounts(aln)
+    stats['haptypes'] = (hapCounts > 0).sum(axis=1)
+    stats['hapdiv'] = haplotypeDiversity(hapCounts, nsam)
+    stats['tajimasd'] = tajimasD(stats['segsites'], stats['pairdiffs'], nsam)
+    stats['fusf'] = fusFs(stats['haptypes'], stats['pairdiffs'], nsam, logS)
+    stats['r2'] = ramosOnsinsR2(aln, counts, stats['segsites'], stats['pairdiffs'])
+    stats['sfs'] = foldedSFS(counts, nsam)
+    return stats
+
+
+def main(storeFiles, outName, batchSize = 1000):
+    fout = open(outName, "w")
+    fout.write("\t".join(['index', 'species', 'nsam', 'nsites'] + STATS + ['sfs']) + "\n")
+    for fpath in storeFiles:
+        species = os.path.splitext(os.path.basename(fpath))[0]
+        logS = {}
+        for indices, aln in readBatches(fpath, batchSize):
+            m, nsam, nsites = aln.shape
+            if nsam not in logS:
+                logS[nsam] = logStirling(nsam)
+            stats = computeAlignmentStats(aln, logS[nsam])
+            for i in range(m):
+                values = ["%.15f" %(stats[s][i]) for s in STATS]
+                sfs = ",".join(map(str, stats['sfs'][i]))
+                fout.write("\t".join([indices[i], species, str(nsam), str(nsites)] + values + [sfs]) + "\n")
+    fout.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.stderr.write("USAGE: %s <alignment store directory or .aln file> <output>\n" %(sys.argv[0]))
+        sys.exit(1)
+    if os.path.isdir(sys.argv[1]):
+        files = sorted(glob.glob(os.path.join(sys.argv[1], "*.aln")))
+    else:
+        files = [sys.argv[1]]
+    main(files, sys.argv[2])
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import sys
+import os
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import ColumnStats, columnStatsPath
+
+
+"""
+Manage the column statistics sidecars (<hyperstats file>.stats.json) written by hBayeSSC.py.
+
+'build' computes the sidecar of hyperstats files written without one (or changed since).
+'merge' writes the sidecar of a hyperstats file that is the concatenation of other hyperstats files,
+from their sidecars (for instance after 'cat hyperstats_iterations_200.txt hyperstats_iterations_100.txt > combined.txt').
+'show' prints the number of values, mean and standard deviation of every column.
+"""
+
+
+def build(files, workers = 1):
+    for fname in files:
+        ColumnStats.forTable(fname, workers)
+
+
+def merge(combined, parts, workers = 1):
+    stats = ColumnStats.forTable(parts[0], workers)
+    for fname in parts[1:]:
+        stats = stats.merge(ColumnStats.forTable(fname, workers))
+    if os.path.getsize(combined) != sum([os.path.getsize(fname) for fname in parts]):
+        raise ValueError("'%s' is not the concatenation of %s" %(combined, ", ".join(parts)))
+    stats.save(combined)
+
+
+def show(fname, fout = sys.stdout, workers = 1):
+    stats = ColumnStats.forTable(fname, workers)
+    print("\t".join(['column', 'n', 'mean', 'sd']), file=fout)
+    for column, (mean, sd), stat in zip(stats.columns, stats.scaling(range(1, len(stats.columns) + 1)), stats.stats):
+        print("\t".join([column, str(stat.n), "%.15f" %(mean), "%.15f" %(sd)]), file=fout)
+
+
+def main():
+    parser = OptionParser("%prog build <hyperstats> [<hyperstats> ...]\n       %prog merge <combined hyperstats> <hyperstats> [<hyperstats> ...]\n       %prog show <hyperstats>")
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the hyperstats files without an up to date sidecar [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    if len(args) >= 2 and args[0] == 'build':
+        build(args[1:], options.workers)
+    elif len(args) >= 3 and args[0] == 'merge':
+        try:
+            merge(args[1], args[2:], options.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        print("Wrote '%s'" %(columnStatsPath(args[1])), file=sys.stderr)
+    elif len(args) == 2 and args[0] == 'show':
+        show(args[1], workers = options.workers)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 import sys
+import os
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import mapRanges, rangeRows
 
 
 """
@@ -9,33 +14,48 @@ import sys
 a. split row on \t
 b. remove UID column
 c. divide remaining columns by the total record count found in the UID
+The iterations data is parsed in byte ranges by --workers processes (see mapRanges() in hBayeSSC.py).
 """
 
-if len(sys.argv) != 5:
-    print "USAGE: %s <UID list/hyperstats file> <Iteration data> <filtered output> <counts output>"%(sys.argv[0])
-    sys.exit(0)
-
-UIDs = dict([ (i.strip().split("\t")[0], None ) for i in open(sys.argv[1], "rU")])
-
-counts = {}
-fout = open(sys.argv[3], "w")
-
-for l in open(sys.argv[2]):
-    l = l.strip()
-    ls = l.split("\t")
-    if ls[0] not in UIDs:
-        continue
-    print >> fout, l
-    splitID = ls[0].split("_")
-    congruent = int(splitID[-6])
-    total = int(splitID[-7])
-    reclen = (len(ls) - 1) / total
-    
-    for x in ls[1: (congruent * reclen + 1) :reclen]:
-        if x not in counts:
-            counts[x] = 0
-        counts[x] += 1
-fout.close()
-fout = open(sys.argv[4], "w")
-print >> fout, "\n".join([ "%s\t%s"%(j,k) for j, k in counts.iteritems()])
-fout.close()
+
+def countAndFilter(uidName, iterName, filteredName, countsName, workers = 1):
+    UIDs = set([i.strip().split("\t")[0] for i in open(uidName, "r") if i.strip()])
+
+    counts = {}
+    fout = open(filteredName, "w")
+
+    for rows in mapRanges(rangeRows, iterName, (UIDs,), workers):
+        for l in rows:
+            l = l.strip()
+            ls = l.split("\t")
+            print(l, file=fout)
+            splitID = ls[0].split("_")
+            congruent = int(splitID[-6])
+            total = int(splitID[-7])
+            reclen = (len(ls) - 1) // total
+
+            for x in ls[1: (congruent * reclen + 1) :reclen]:
+                if x not in counts:
+                    counts[x] = 0
+                counts[x] += 1
+    fout.close()
+    fout = open(countsName, "w")
+    print("\n".join([ "%s\t%s"%(j,k) for j, k in counts.items()]), file=fout)
+    fout.close()
+
+
+def main():
+    parser = OptionParser("%prog <UID list/hyperstats file> <Iteration data> <filtered output> <counts output>")
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the iteration data [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    if len(args) != 4:
+        parser.print_help()
+        sys.exit(1)
+    countAndFilter(args[0], args[1], args[2], args[3], options.workers)
+
+
+if __name__ == "__main__":
+    main()
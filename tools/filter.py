@@ -1,19 +1,38 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 import sys
+import os
+from optparse import OptionParser
 
-def selectRuns(uidlst, run_dat, filteredF):
-    uids = dict([(l.strip().split()[0], None,) for l in open(uidlst, "rU")])
-    rundat = open(run_dat, "rU")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import mapRanges, rangeRows
+
+
+"""
+Write the rows of a run data file whose UID is in a UID list.
+The run data is parsed in byte ranges by --workers processes (see mapRanges() in hBayeSSC.py).
+"""
+
+
+def selectRuns(uidlst, run_dat, filteredF, workers = 1):
+    uids = set([l.strip().split()[0] for l in open(uidlst, "r") if l.strip()])
     fout = open(filteredF, "w")
-    for l in rundat:
-	ident = l.strip().split()[0]
-	if ident not in uids:
-	    continue
-	fout.write(l)
+    for rows in mapRanges(rangeRows, run_dat, (uids,), workers):
+        fout.writelines(rows)
     fout.close()
-    
-if len(sys.argv) != 4:
-    print "USAGE: %s <UID LIST> <RUN DAT> <OUTPUT>"%(sys.argv[0])
-    sys.exit(1)
-    
-selectRuns(sys.argv[1], sys.argv[2], sys.argv[3])
+
+
+def main():
+    parser = OptionParser("%prog <UID LIST> <RUN DAT> <OUTPUT>")
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the run data [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    if len(args) != 3:
+        parser.print_help()
+        sys.exit(1)
+    selectRuns(args[0], args[1], args[2], options.workers)
+
+
+if __name__ == "__main__":
+    main()
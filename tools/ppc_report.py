@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import sys
+import os
+import warnings
+from optparse import OptionParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import statsHeader, resolveColumns, mapRanges, rangeColumns
+
+
+"""
+Posterior predictive check of the observed community.
+
+The posterior hyperstats ('hBayeSSC.py --mode posterior') are parsed in byte ranges by --workers
+processes into a single (rows, columns) array, and every statistic below is computed for all the columns at once:
+- the posterior mean, standard deviation and quantiles of the column
+- the lower and upper tail probabilities of the observed value (P(sim <= obs), P(sim >= obs))
+  and the two sided p-value 2 * min(lower, upper)
+- z, the observed value standardized by the posterior mean and standard deviation
+With --mahalanobis a last 'mahalanobis' line checks the selected columns together: the observed
+value is the Mahalanobis distance of the observation from the posterior mean, and the tail
+probabilities compare it to the distances of the posterior rows themselves.
+
+NaN values (for instance Tajima's D without segregating sites) are left out column by column.
+"""
+
+DEFAULT_COLUMNS = statsHeader()[statsHeader().index('haptypes_Mean'):]
+QUANTILES = [0.025, 0.05, 0.25, 0.5, 0.75, 0.95, 0.975]
+REPORT_HEADER = ['column', 'observed', 'n', 'mean', 'sd'] + ["q%s" %(q) for q in QUANTILES] + ['p_lower', 'p_upper', 'p_two_sided', 'z']
+
+
+def readColumns(fname, positions, workers = 1):
+    """ the selected columns of every row of a hyperstats file, as a (rows, columns) array """
+    chunks = [np.frombuffer(values, dtype=np.float64) for offsets, indices, values in mapRanges(rangeColumns, fname, (positions,), workers)]
+    return np.concatenate(chunks).reshape(-1, len(positions))
+
+
+def tailProbabilities(sims, observed):
+    """ P(sim <= obs) and P(sim >= obs) of every column, over the finite simulated values """
+    finite = np.isfinite(sims)
+    n = finite.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lower = ((sims <= observed) & finite).sum(axis=0) / n
+        upper = ((sims >= observed) & finite).sum(axis=0) / n
+    lower[~np.isfinite(observed)] = np.nan
+    upper[~np.isfinite(observed)] = np.nan
+    return n, lower, upper
+
+
+def columnReport(sims, observed):
+    """ one row of REPORT_HEADER values (without the column name) per column """
+    n, lower, upper = tailProbabilities(sims, observed)
+    # all NaN columns give NaN statistics, without a warning for each
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(sims, axis=0)
+        sd = np.nanstd(sims, axis=0, ddof=1)
+        quantiles = np.nanquantile(sims, QUANTILES, axis=0)
+        z = (observed - mean) / sd
+    z[~(sd > 0)] = np.nan
+    twoSided = np.minimum(2.0 * np.minimum(lower, upper), 1.0)
+    return np.column_stack([observed, n, mean, sd, quantiles.T, lower, upper, twoSided, z])
+
+
+def mahalanobis(sims, observed):
+    """
+    the Mahalanobis distance of the observation and of every posterior row from the posterior mean.
+    Rows with a NaN in the columns and constant columns are left out, the pseudo inverse handles collinear columns.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        keep = np.isfinite(observed) & (np.nanstd(sims, axis=0) > 0)
+    sims = sims[:, keep]
+    sims = sims[np.isfinite(sims).all(axis=1)]
+    if sims.shape[0] < 2 or sims.shape[1] == 0:
+        return np.nan, np.array([])
+    mean = sims.mean(axis=0)
+    precision = np.linalg.pinv(np.cov(sims, rowvar=False).reshape(sims.shape[1], sims.shape[1]))
+    centered = sims - mean
+    simDistances = np.sqrt(np.einsum('ij,jk,ik->i', centered, precision, centered))
+    diff = observed[keep] - mean
+    return np.sqrt(diff.dot(precision).dot(diff)), simDistances
+
+
+def report(posteriorName, observedName, outName, columns, multivariate = False, workers = 1):
+    positions = resolveColumns(columns)
+    observed = readColumns(observedName, positions)
+    if len(observed) == 0:
+        raise ValueError("No observation row found in '%s'" %(observedName))
+    if len(observed) > 1:
+        print("'%s' has %s rows, only the first one is checked" %(observedName, len(observed)), file=sys.stderr)
+    observed = observed[0]
+    sims = readColumns(posteriorName, positions, workers)
+    if len(sims) == 0:
+        raise ValueError("No posterior row found in '%s'" %(posteriorName))
+
+    names = [statsHeader()[p - 1] for p in positions]
+    rows = list(zip(names, columnReport(sims, observed)))
+    if multivariate:
+        distance, simDistances = mahalanobis(sims, observed)
+        n, lower, upper = tailProbabilities(simDistances[:, None], np.array([distance]))
+        values = [np.nan] * len(REPORT_HEADER[1:])
+        values[0] = distance
+        values[1] = n[0]
+        if len(simDistances):
+            values[2] = simDistances.mean()
+            values[3] = simDistances.std(ddof=1)
+            values[4:4 + len(QUANTILES)] = np.quantile(simDistances, QUANTILES)
+        values[-4] = lower[0]
+        values[-3] = upper[0]
+        values[-2] = min(2.0 * min(lower[0], upper[0]), 1.0)
+        rows.append(('mahalanobis', np.array(values, dtype=np.float64)))
+
+    fout = open(outName, "w")
+    fout.write("\t".join(REPORT_HEADER) + "\n")
+    for name, values in rows:
+        fout.write("\t".join([name, "%.15f" %(values[0]), "%d" %(values[1])] + ["%.15f" %(v) for v in values[2:]]) + "\n")
+    fout.close()
+    return len(sims)
+
+
+def main():
+    parser = OptionParser("%prog [options] <post_hyperstats_iterations_N.txt> <hyperstats_observations.txt> <output>")
+    parser.add_option("-c", "--columns", dest = "columns", help = "Comma separated hyperstats columns (names or msReject column numbers) to check [default: haptypes_Mean to segsites_Kurtosis]", action = "store", type = "string", metavar = "COLS", default = ",".join(DEFAULT_COLUMNS))
+    parser.add_option("-m", "--mahalanobis", action = "store_true", dest = "mahalanobis", default = False, help = "When set, also check the selected columns together with the Mahalanobis distance")
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the posterior hyperstats [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if len(args) != 3:
+        parser.print_help()
+        sys.exit(1)
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    try:
+        rows = report(args[0], args[1], args[2], options.columns.split(","), options.mahalanobis, options.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Checked the observation against %s posterior rows" %(rows), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import sys
+import os
+from optparse import OptionParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import statsHeader, resolveColumns, mapRanges, rangeColumns
+
+
+"""
+Project the hyperstats onto a few components before the rejection step.
+
+'fit' learns the projection from a pilot set of hyperstats rows (for instance a sample drawn with
+sample_prior.py): the selected columns are standardized and either their principal components (pca),
+or the partial least squares components that best predict the target columns (pls), are kept.
+The column positions, the scaling and the rotation are stored in a .npz file.
+
+'transform' streams a hyperstats file (the reference table or hyperstats_observations.txt) through a
+stored projection and writes the index followed by the components.
+Both parse their input in byte ranges, with --workers processes.
+"""
+
+DEFAULT_COLUMNS = statsHeader()[statsHeader().index('haptypes_Mean'):]
+DEFAULT_TARGETS = ['congruent_group_size', 'overall_time_Dispersion']
+
+
+def readRows(fname, positions, workers = 1):
+    """ generator that returns (indices, values) with the selected columns of the rows of a byte range """
+    for offsets, indices, values in mapRanges(rangeColumns, fname, (positions,), workers):
+        yield indices, np.frombuffer(values, dtype=np.float64).reshape(-1, len(positions))
+
+
+def standardize(values):
+    center = values.mean(axis=0)
+    scale = values.std(axis=0, ddof=1)
+    scale[~(scale > 0)] = 1.0
+    return center, scale
+
+
+def fitPCA(X, components):
+    """ rotation made of the first principal axes of the standardized matrix X """
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    explained = s ** 2 / (s ** 2).sum()
+    return Vt[:components].T, explained[:components]
+
+
+def fitPLS(X, Y, components):
+    """
+    PLS2 by NIPALS.  The rotation R = W (P'W)^-1 maps the standardized X straight onto the scores,
+    so transforming new rows is a single matrix product.
+    """
+    X = X.copy()
+    Y = Y.copy()
+    W = []
+    P = []
+    explained = []
+    total = (Y ** 2).sum()
+    for c in range(components):
+        u, s, vt = np.linalg.svd(X.T.dot(Y), full_matrices=False)
+        w = u[:, 0]
+        t = X.dot(w)
+        tt = t.dot(t)
+        if tt <= 0:
+            break
+        p = X.T.dot(t) / tt
+        q = Y.T.dot(t) / tt
+        X -= np.outer(t, p)
+        Y -= np.outer(t, q)
+        W.append(w)
+        P.append(p)
+        explained.append(1.0 - (Y ** 2).sum() / total - sum(explained))
+    W = np.array(W).T
+    P = np.array(P).T
+    return W.dot(np.linalg.inv(P.T.dot(W))), np.array(explained)
+
+
+def fit(pilot, outName, columns, method, components, targets, workers = 1):
+    positions = resolveColumns(columns)
+    targetPositions = []
+    if method == 'pls':
+        targetPositions = resolveColumns(targets)
+    values = np.concatenate([v for i, v in readRows(pilot, positions + targetPositions, workers)])
+    values = values[np.isfinite(values).all(axis=1)]
+    if len(values) < 2:
+        raise ValueError("The pilot file needs at least 2 rows without NaN in the selected columns")
+    X = values[:, :len(positions)]
+    center, scale = standardize(X)
+    X = (X - center) / scale
+    components = min(components, X.shape[1])
+    if method == 'pca':
+        rotation, explained = fitPCA(X, components)
+    else:
+        Y = values[:, len(positions):]
+        ycenter, yscale = standardize(Y)
+        rotation, explained = fitPLS(X, (Y - ycenter) / yscale, components)
+    np.savez(outName, method=method, positions=np.array(positions), center=center, scale=scale,
+             rotation=rotation, explained=explained, rows=len(values))
+    return explained
+
+
+def transform(projName, inName, outName, workers = 1):
+    proj = np.load(projName)
+    positions = [int(p) for p in proj['positions']]
+    center, scale, rotation = proj['center'], proj['scale'], proj['rotation']
+    fout = open(outName, "w")
+    for indices, values in readRows(inName, positions, workers):
+        scores = ((values - center) / scale).dot(rotation)
+        for indx, row in zip(indices, scores):
+            fout.write("\t".join([indx] + ["%.15f" %(v) for v in row]) + "\n")
+    fout.close()
+
+
+def main():
+    parser = OptionParser("%prog fit [options] <pilot hyperstats> <projection.npz>\n       %prog transform <projection.npz> <hyperstats> <output>")
+    parser.add_option("-m", "--method", dest = "method", help = "Projection to fit [ 'pca', 'pls' ] [default: %default]", action = "store", type = "choice", choices = ['pca', 'pls'], default = "pca")
+    parser.add_option("-k", "--components", dest = "components", help = "Number of components to keep [default: %default]", action = "store", type = "int", metavar = "NUM", default = 4)
+    parser.add_option("-c", "--columns", dest = "columns", help = "Comma separated hyperstats columns (names or msReject column numbers) to project [default: haptypes_Mean to segsites_Kurtosis]", action = "store", type = "string", metavar = "COLS", default = ",".join(DEFAULT_COLUMNS))
+    parser.add_option("", "--targets", dest = "targets", help = "Comma separated hyperstats columns the pls components should predict [default: %default]", action = "store", type = "string", metavar = "COLS", default = ",".join(DEFAULT_TARGETS))
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the input hyperstats [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    if len(args) == 3 and args[0] == 'fit':
+        try:
+            explained = fit(args[1], args[2], options.columns.split(","), options.method, options.components, options.targets.split(","), options.workers)
+        except ValueError as e:
+            parser.error(str(e))
+        print("Explained variance by component: %s" %(" ".join(["%.4f" %(e) for e in explained])), file=sys.stderr)
+    elif len(args) == 4 and args[0] == 'transform':
+        transform(args[1], args[2], args[3], options.workers)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import sys
+import os
+from optparse import OptionParser
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import ColumnStats, resolveColumns, mapRanges, rangeColumns
+
+
+"""
+Rejection step for several column subsets and tolerances in a single pass over the reference table.
+
+Like msReject, every selected column is divided by its standard deviation over the reference table and the
+rows closest (euclidean distance) to the observation are accepted, tolerance * rows of them.  The standard
+deviations come from the column statistics sidecar of the table (built with one extra pass when it is missing).
+
+The table is parsed in byte ranges by --workers processes, the distance of every row is computed for every subset,
+and each subset keeps the rows of its largest tolerance only (by their byte offset in the table); the acceptance set of a
+smaller tolerance is the head of that list.
+Each (subset, tolerance) acceptance set is written in the same format as the msReject output,
+<prefix>_subset<N>_tol<tolerance>.txt, and <prefix>_summary.tsv lists them all.
+"""
+
+
+def readChunks(fname, positions, workers = 1):
+    """ generator that returns (offsets, values) with the byte offsets and the selected columns of the rows of a byte range """
+    for offsets, indices, values in mapRanges(rangeColumns, fname, (positions,), workers):
+        yield np.frombuffer(offsets, dtype=np.int64), np.frombuffer(values, dtype=np.float64).reshape(-1, len(positions))
+
+
+class TopK(object):
+    """ the k rows with the smallest distances seen so far, with their position and byte offset in the table """
+    def __init__(self, k):
+        self.k = k
+        self.distances = np.empty(0, dtype=np.float64)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.offsets = np.empty(0, dtype=np.int64)
+
+    def push(self, distances, firstRow, offsets):
+        finite = np.isfinite(distances)
+        distances = np.concatenate([self.distances, distances[finite]])
+        rows = np.concatenate([self.rows, (firstRow + np.arange(len(finite)))[finite]])
+        offsets = np.concatenate([self.offsets, offsets[finite]])
+        if len(distances) > self.k:
+            keep = np.argpartition(distances, self.k - 1)[:self.k]
+            distances, rows, offsets = distances[keep], rows[keep], offsets[keep]
+        self.distances, self.rows, self.offsets = distances, rows, offsets
+
+    def accepted(self, count):
+        """ the count closest rows (distance, row, byte offset), in table order """
+        closest = np.lexsort((self.rows, self.distances))[:count]
+        closest = closest[np.argsort(self.rows[closest])]
+        return self.distances[closest], self.rows[closest], self.offsets[closest]
+
+
+def acceptedCount(tolerance, rows):
+    return max(1, int(round(tolerance * rows)))
+
+
+def copyRows(fname, offsets, outName):
+    """ write the rows of fname that begin at the byte offsets to outName """
+    fin = open(fname, "rb")
+    fout = open(outName, "wb")
+    for offset in offsets:
+        fin.seek(offset)
+        fout.write(fin.readline())
+    fout.close()
+    fin.close()
+
+
+def reject(tableName, obsName, outPrefix, subsets, tolerances, workers = 1):
+    """ write the acceptance set of every (subset, tolerance), returns the summary rows """
+    subsetPositions = [resolveColumns(columns) for columns in subsets]
+    positions = sorted(set(sum(subsetPositions, [])))
+    where = [[positions.index(p) for p in sp] for sp in subsetPositions]
+
+    stats = ColumnStats.forTable(tableName, workers)
+    scales = np.array([sd for mean, sd in stats.scaling(positions)])
+    scales[~(scales > 0)] = 1.0
+    observed = next(readChunks(obsName, positions))[1][0]
+    if not np.isfinite(observed).all():
+        raise ValueError("The observation has no value for columns %s" %(", ".join([str(p + 1) for p, v in zip(positions, observed) if not np.isfinite(v)])))
+
+    k = acceptedCount(max(tolerances), stats.rows)
+    best = [TopK(k) for s in subsets]
+    row = 0
+    for offsets, values in readChunks(tableName, positions, workers):
+        scaled = (values - observed) / scales
+        for cols, topk in zip(where, best):
+            topk.push(np.sqrt((scaled[:, cols] ** 2).sum(axis=1)), row, offsets)
+        row += len(offsets)
+
+    summary = []
+    for s, topk in enumerate(best):
+        for tolerance in tolerances:
+            count = acceptedCount(tolerance, row)
+            distances, rows, offsets = topk.accepted(count)
+            outName = "%s_subset%s_tol%s.txt" %(outPrefix, s + 1, tolerance)
+            copyRows(tableName, offsets, outName)
+            maxDistance = distances.max() if len(distances) else float('NaN')
+            summary.append([str(s + 1), ",".join(subsets[s]), str(tolerance), str(len(offsets)), "%.15f" %(maxDistance), outName])
+    fout = open("%s_summary.tsv" %(outPrefix), "w")
+    fout.write("\t".join(['subset', 'columns', 'tolerance', 'accepted', 'max_distance', 'file']) + "\n")
+    for s in summary:
+        fout.write("\t".join(s) + "\n")
+    fout.close()
+    return summary
+
+
+def main():
+    parser = OptionParser("%prog [options] <reference table> <hyperstats_observations.txt>")
+    parser.add_option("-c", "--columns", dest = "subsets", help = "Comma separated hyperstats columns (names or msReject column numbers) of a subset, repeat the option for more subsets [required]", action = "append", type = "string", metavar = "COLS", default = [])
+    parser.add_option("-t", "--tolerances", dest = "tolerances", help = "Comma separated tolerances (fraction of the table to accept) [required]", action = "store", type = "string", metavar = "TOLS", default = None)
+    parser.add_option("-o", "--output", dest = "output", help = "Prefix of the output files [default: %default]", action = "store", type = "string", metavar = "PREFIX", default = "rejection")
+    parser.add_option("-w", "--workers", dest = "workers", help = "Number of processes parsing the reference table [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1)
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2 or not options.subsets or not options.tolerances:
+        parser.print_help()
+        sys.exit(1)
+    try:
+        tolerances = list(map(float, options.tolerances.split(",")))
+    except ValueError:
+        parser.error("Tolerances must be numbers: '%s'" %(options.tolerances))
+    if [t for t in tolerances if not 0 < t <= 1]:
+        parser.error("Tolerances must be between 0 and 1")
+    if options.workers < 1:
+        parser.error("At least 1 worker is required")
+    try:
+        summary = reject(args[0], args[1], options.output, [s.split(",") for s in options.subsets], tolerances, options.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print("Wrote %s acceptance sets" %(len(summary)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
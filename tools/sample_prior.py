@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import sys
+import os
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hBayeSSC import ReservoirSample, indexModel
+
+
+"""
+Draw a uniform random sample of prior rows from one or more hyperstats (or run data) shards.
+Every row is read once and only the sampled rows are held in memory, so the size of the
+reference table does not matter.  With --stratify a separate sample is drawn for every model
+(the congruent group size found in the index of each row).
+"""
+
+def sampleRows(fileNames, size, stratify = False, rng = random):
+    samples = {}
+    for fname in fileNames:
+        for l in open(fname, "r"):
+            if not l.strip():
+                continue
+            key = None
+            if stratify:
+                key = indexModel(l.split("\t", 1)[0])
+            if key not in samples:
+                samples[key] = ReservoirSample(size, rng)
+            samples[key].Push(l)
+    return samples
+
+
+def main():
+    parser = OptionParser("%prog [options] <hyperstats file> [<hyperstats file> ...]")
+    parser.add_option("-n", "--size", dest = "size", help = "Number of rows to sample (per model with --stratify) [default: %default]", action = "store", type = "int", metavar = "NUM", default = 1000)
+    parser.add_option("", "--stratify", action="store_true", dest="stratify", default=False, help="When set, draws a separate sample for each model number found in the index")
+    parser.add_option("", "--seed", dest = "seed", help = "Random seed [default: random]", action = "store", type = "int", metavar = "NUM", default = None)
+    parser.add_option("-o", "--out", dest = "out", help = "Output file [default: stdout]", action = "store", type = "string", metavar = "FILE", default = None)
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.print_help()
+        parser.error("At least one hyperstats file is required")
+    if options.size < 1:
+        parser.error("Sample size must be at least 1")
+
+    samples = sampleRows(args, options.size, options.stratify, random.Random(options.seed))
+    fout = sys.stdout
+    if options.out:
+        fout = open(options.out, "w")
+    for key in sorted(samples, key = lambda k: (k is not None, k)):
+        if samples[key].seen < options.size:
+            print("Only %s rows available %s" %(samples[key].seen, "for model %s" %(key) if options.stratify else ""), file=sys.stderr)
+        fout.writelines(samples[key].items)
+    if options.out:
+        fout.close()
+
+
+if __name__ == "__main__":
+    main()